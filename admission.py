@@ -0,0 +1,246 @@
+import asyncio
+import os
+from collections import deque
+
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+from starlette.responses import JSONResponse
+
+from metrics import metrics
+
+
+# Admission control для маршрутов, которые ходят в базу. Чтения и записи пускаются через
+# разные "ворота": не больше limit запросов в работе, еще не больше queue ждут в очереди.
+# Очередь полна или ожидание дольше ADMISSION_QUEUE_TIMEOUT - сразу 503 + Retry-After,
+# вместо того чтобы копить запросы на блокировке SQLite, пока клиенты не отвалятся по таймауту.
+# Клиент, отключившийся в очереди, из нее убирается - его запрос не выполняется вовсе.
+# limit <= 0 отключает ограничение. Лимиты меняются на лету через PUT /admission
+ADMISSION_READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", "64"))
+ADMISSION_READ_QUEUE = int(os.getenv("ADMISSION_READ_QUEUE", "256"))
+ADMISSION_WRITE_LIMIT = int(os.getenv("ADMISSION_WRITE_LIMIT", "32"))
+ADMISSION_WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", "128"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+ADMISSION_PREFIXES = tuple(os.getenv("ADMISSION_PREFIXES", "/family,/users,/tasks,/check").split(","))
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class AdmissionGate:
+    def __init__(self, name: str, limit: int, queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        # Ждущие запросы по порядку прихода; освободившийся слот передается первому
+        self.waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.disconnected = 0
+
+    def try_enter(self) -> bool:
+        if self.limit <= 0 or (self.active < self.limit and not self.waiters):
+            self.active += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def queue_full(self) -> bool:
+        return len(self.waiters) >= self.queue
+
+    def enqueue(self) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        return waiter
+
+    def leave_queue(self, waiter: asyncio.Future):
+        # Таймаут или отключение клиента. Если слот уже успели передать - возвращаем его
+        if waiter.done():
+            self.release()
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # Слот переходит ждущему, active не меняется
+                self.admitted += 1
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def configure(self, limit: int | None = None, queue: int | None = None):
+        if limit is not None:
+            self.limit = limit
+        if queue is not None:
+            self.queue = queue
+        # Лимит подняли - сразу пускаем ждущих в новые слоты
+        while self.waiters and (self.limit <= 0 or self.active < self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                self.admitted += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue": self.queue,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "disconnected": self.disconnected,
+        }
+
+
+class Admission:
+    def __init__(self):
+        self.read = AdmissionGate("read", ADMISSION_READ_LIMIT, ADMISSION_READ_QUEUE)
+        self.write = AdmissionGate("write", ADMISSION_WRITE_LIMIT, ADMISSION_WRITE_QUEUE)
+        self.queue_timeout = ADMISSION_QUEUE_TIMEOUT
+        self.retry_after = ADMISSION_RETRY_AFTER
+        self.prefixes = ADMISSION_PREFIXES
+
+    def gate_for(self, scope) -> AdmissionGate | None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            return None
+        return self.read if scope["method"] in READ_METHODS else self.write
+
+    def stats(self) -> dict:
+        return {
+            "queue_timeout": self.queue_timeout,
+            "retry_after": self.retry_after,
+            "read": self.read.stats(),
+            "write": self.write.stats(),
+        }
+
+
+admission = Admission()
+
+
+def register_gate_metrics(gate: AdmissionGate):
+    prefix = f"admission_{gate.name}"
+    metrics.register_gauge(f"{prefix}_active", f"{gate.name} requests running", lambda: gate.active)
+    metrics.register_gauge(f"{prefix}_queued", f"{gate.name} requests waiting for a slot", lambda: len(gate.waiters))
+    metrics.register_gauge(f"{prefix}_limit", f"{gate.name} concurrency limit", lambda: gate.limit)
+    metrics.register_gauge(f"{prefix}_rejected", f"{gate.name} requests shed because the queue was full", lambda: gate.rejected)
+    metrics.register_gauge(f"{prefix}_timed_out", f"{gate.name} requests shed after waiting too long", lambda: gate.timed_out)
+    metrics.register_gauge(
+        f"{prefix}_disconnected", f"queued {gate.name} requests dropped after the client went away", lambda: gate.disconnected
+    )
+
+
+register_gate_metrics(admission.read)
+register_gate_metrics(admission.write)
+
+
+async def watch_disconnect(receive, buffered: list) -> bool:
+    # Пока запрос в очереди, читаем receive, чтобы заметить http.disconnect.
+    # Прочитанное тело сохраняем и потом отдаем приложению. Длинное тело (more_body)
+    # дальше не читаем, чтобы не держать его в памяти: такой клиент просто ждет очереди
+    while True:
+        message = await receive()
+        buffered.append(message)
+        if message["type"] == "http.disconnect":
+            return True
+        if message.get("more_body"):
+            return False
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        gate = admission.gate_for(scope)
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        buffered = []
+        if not gate.try_enter():
+            if gate.queue_full():
+                gate.rejected += 1
+                await self.reject(scope, receive, send, f"Too many {gate.name} requests in queue")
+                return
+            outcome = await self.wait_turn(gate, receive, buffered)
+            if outcome == "disconnected":
+                return  # отвечать некому
+            if outcome == "timeout":
+                await self.reject(scope, receive, send, f"Timed out waiting for a {gate.name} slot")
+                return
+
+        async def replay_receive():
+            if buffered:
+                return buffered.pop(0)
+            return await receive()
+
+        try:
+            await self.app(scope, replay_receive, send)
+        finally:
+            gate.release()
+
+    async def wait_turn(self, gate: AdmissionGate, receive, buffered: list) -> str:
+        waiter = gate.enqueue()
+        watcher = asyncio.ensure_future(watch_disconnect(receive, buffered))
+        deadline = asyncio.get_running_loop().time() + admission.queue_timeout
+        pending = {waiter, watcher}
+        try:
+            while waiter in pending:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if watcher in done and watcher.exception() is None and watcher.result() and not waiter.done():
+                    gate.leave_queue(waiter)
+                    gate.disconnected += 1
+                    return "disconnected"
+            if waiter.done():
+                return "admitted"
+            gate.leave_queue(waiter)
+            gate.timed_out += 1
+            return "timeout"
+        except asyncio.CancelledError:
+            gate.leave_queue(waiter)
+            raise
+        finally:
+            watcher.cancel()
+
+    async def reject(self, scope, receive, send, detail: str):
+        response = JSONResponse(
+            {"detail": detail}, status_code=503, headers={"Retry-After": str(admission.retry_after)}
+        )
+        await response(scope, receive, send)
+
+
+class AdmissionSettings(BaseModel):
+    read_limit: int | None = None
+    read_queue: int | None = Field(None, ge=0)
+    write_limit: int | None = None
+    write_queue: int | None = Field(None, ge=0)
+    queue_timeout: float | None = Field(None, gt=0)
+    retry_after: int | None = Field(None, ge=0)
+
+
+router = APIRouter(prefix="/admission", tags=["Admission"])
+
+
+@router.get("")
+async def admission_stats():
+    return admission.stats()
+
+
+@router.put("")
+async def configure_admission(settings: AdmissionSettings):
+    admission.read.configure(settings.read_limit, settings.read_queue)
+    admission.write.configure(settings.write_limit, settings.write_queue)
+    if settings.queue_timeout is not None:
+        admission.queue_timeout = settings.queue_timeout
+    if settings.retry_after is not None:
+        admission.retry_after = settings.retry_after
+    return admission.stats()
@@ -0,0 +1,390 @@
+import asyncio
+import os
+import time
+from itertools import chain
+
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy import literal_column, select
+from starlette.concurrency import run_in_threadpool
+
+from db import read_session
+from metrics import metrics
+from models import GraphEpoch, ParentChildAssociation, PersonIdentity
+
+try:
+    import numpy as np
+except ImportError:  # без numpy аналитика недоступна, остальное приложение работает
+    np = None
+
+
+# Аналитика по всему графу семей. Вместо обхода Parent.children / Child.parents граф целиком
+# лежит в памяти в виде CSR: indptr[p]..indptr[p + 1] - срез indices с детьми родителя p
+# (индексы массивов - id из базы), identity[c] - id записи ребенка c как родителя (-1 - нет).
+# Снимок обновляется перед каждым запросом: новые связи дочитываются по rowid association
+# и вливаются в CSR за один проход; если связи удалялись или менялся person_identity
+# (счетчики graph_epochs, см. models.py) - снимок строится заново. Снимок неизменяемый:
+# обновление собирает новый, а посчитанные метрики кэшируются на самом снимке
+ANALYTICS_LOAD_CHUNK = int(os.getenv("ANALYTICS_LOAD_CHUNK", "100000"))
+ANALYTICS_MAX_TOP = 100
+
+rowid = literal_column("rowid")
+
+
+class GraphSnapshot:
+    def __init__(self, indptr, indices, identity, watermark: int, epochs: dict[str, int]):
+        self.indptr = indptr
+        self.indices = indices
+        self.identity = identity
+        # Наибольший rowid association, уже вошедший в снимок
+        self.watermark = watermark
+        self.epochs = epochs
+        self.built_at = time.time()
+        self.results: dict = {}
+
+    @property
+    def links(self) -> int:
+        return len(self.indices)
+
+    def arrays(self) -> dict:
+        return {"indptr": self.indptr, "indices": self.indices, "identity": self.identity}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def link_parents(self):
+        # Родитель каждой связи - строка CSR, развернутая обратно в COO
+        return np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr))
+
+    def cached(self, key, compute):
+        if key not in self.results:
+            self.results[key] = compute(self)
+        return self.results[key]
+
+
+def build_csr(parents, children):
+    order = np.lexsort((children, parents))
+    counts = np.bincount(parents, minlength=1)
+    indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, children[order].astype(np.int32)
+
+
+def merge_links(snapshot: GraphSnapshot, parents, children, watermark: int) -> GraphSnapshot:
+    # Новые связи встают в конец срезов своих родителей: np.insert копирует массив один раз,
+    # без сортировки всего графа
+    order = np.argsort(parents, kind="stable")
+    parents, children = parents[order], children[order]
+    size = max(len(snapshot.indptr) - 1, int(parents.max()) + 1)
+    indptr = np.concatenate([
+        snapshot.indptr, np.full(size + 1 - len(snapshot.indptr), snapshot.indptr[-1], dtype=np.int64)
+    ])
+    indices = np.insert(snapshot.indices, indptr[parents + 1], children.astype(np.int32))
+    counts = np.diff(indptr) + np.bincount(parents, minlength=size)
+    np.cumsum(counts, out=indptr[1:])
+    return GraphSnapshot(indptr, indices, snapshot.identity, watermark, snapshot.epochs)
+
+
+def gather(indptr, indices, rows):
+    # Склеенные срезы indices для строк rows - без цикла по строкам
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return indices[offsets]
+
+
+def children_per_parent(snapshot: GraphSnapshot) -> dict:
+    degrees = np.diff(snapshot.indptr)
+    degrees = degrees[degrees > 0]
+    if not len(degrees):
+        return {"parents": 0, "links": 0, "mean": 0.0, "max": 0, "percentiles": {}, "histogram": []}
+    histogram = np.bincount(degrees)
+    p50, p90, p99 = np.percentile(degrees, [50, 90, 99])
+    return {
+        "parents": int(len(degrees)),
+        "links": snapshot.links,
+        "mean": float(degrees.mean()),
+        "max": int(degrees.max()),
+        "percentiles": {"p50": float(p50), "p90": float(p90), "p99": float(p99)},
+        "histogram": [{"children": int(k), "parents": int(n)} for k, n in enumerate(histogram) if n],
+    }
+
+
+def parent_graph(snapshot: GraphSnapshot) -> dict:
+    # Граф между родителями: p -> q, если у p есть ребенок, который сам записан родителем q.
+    # Уровень родителя - длина самой длинной цепочки предков над ним (алгоритм Кана по слоям)
+    sources = snapshot.link_parents()
+    targets = np.full(len(sources), -1, dtype=np.int64)
+    has_identity = snapshot.indices < len(snapshot.identity)
+    targets[has_identity] = snapshot.identity[snapshot.indices[has_identity]]
+    linked = targets >= 0
+    sources, targets = sources[linked], targets[linked]
+
+    size = max(len(snapshot.indptr) - 1, int(targets.max()) + 1 if len(targets) else 0)
+    present = np.zeros(size, dtype=bool)
+    present[:len(snapshot.indptr) - 1] = np.diff(snapshot.indptr) > 0
+    present[targets] = True
+    edge_ptr, edge_targets = build_csr(sources, targets)
+    edge_ptr = np.concatenate([edge_ptr, np.full(size + 1 - len(edge_ptr), edge_ptr[-1], dtype=np.int64)])
+
+    indegree = np.bincount(targets, minlength=size)
+    level = np.full(size, -1, dtype=np.int32)
+    frontier = np.flatnonzero(present & (indegree == 0))
+    depth = 0
+    while len(frontier):
+        level[frontier] = depth
+        reached = gather(edge_ptr, edge_targets, frontier)
+        indegree -= np.bincount(reached, minlength=size)
+        frontier = np.unique(reached[indegree[reached] == 0])
+        depth += 1
+    return {"level": level, "present": present}
+
+
+def generations(snapshot: GraphSnapshot) -> dict:
+    graph = snapshot.cached("parent_graph", parent_graph)
+    level, present = graph["level"], graph["present"]
+    levels = level[present & (level >= 0)]
+    per_level = np.bincount(levels) if len(levels) else np.zeros(0, dtype=np.int64)
+    return {
+        # Поколения людей: уровни родителей плюс дети последнего уровня
+        "generations": len(per_level) + 1 if len(per_level) else 0,
+        "parents_per_generation": [int(n) for n in per_level],
+        # Родители на цикле (ошибка в данных person_identity) - в уровни не попадают
+        "cyclic_parents": int((present & (level < 0)).sum()),
+    }
+
+
+def descendants_of(snapshot: GraphSnapshot, parent_id: int) -> tuple[int, int]:
+    # Точный обход вниз: (число разных потомков, число поколений под родителем)
+    seen_children = np.zeros(max(snapshot.indices.max(initial=-1) + 1, 1), dtype=bool)
+    seen_parents = np.zeros(len(snapshot.indptr), dtype=bool)
+    frontier = np.array([parent_id], dtype=np.int64)
+    total = depth = 0
+    while len(frontier):
+        seen_parents[frontier] = True
+        kids = np.unique(gather(snapshot.indptr, snapshot.indices, frontier))
+        kids = kids[~seen_children[kids]]
+        if not len(kids):
+            break
+        seen_children[kids] = True
+        total += len(kids)
+        depth += 1
+        kids = kids[kids < len(snapshot.identity)]
+        frontier = snapshot.identity[kids]
+        frontier = frontier[(frontier >= 0) & (frontier < len(snapshot.indptr) - 1)]
+        frontier = frontier[~seen_parents[frontier]]
+    return total, depth
+
+
+def largest_trees(snapshot: GraphSnapshot, limit: int) -> list[dict]:
+    graph = snapshot.cached("parent_graph", parent_graph)
+    level = graph["level"]
+    if not snapshot.links:
+        return []
+    # Кандидаты - по числу путей вниз (снизу вверх по уровням, одна сумма на слой).
+    # Потомок, до которого два пути, тут посчитан дважды, поэтому кандидатов берем с запасом
+    # и для них считаем точный обход
+    parents = snapshot.link_parents()
+    paths = np.zeros(len(level), dtype=np.int64)
+    below = np.zeros(snapshot.links, dtype=np.int64)
+    has_identity = snapshot.indices < len(snapshot.identity)
+    as_parent = np.full(snapshot.links, -1, dtype=np.int64)
+    as_parent[has_identity] = snapshot.identity[snapshot.indices[has_identity]]
+    link_level = level[parents]
+    for depth in range(int(level.max()), -1, -1):
+        at_depth = link_level == depth
+        below[at_depth] = 1
+        continued = at_depth & (as_parent >= 0)
+        below[continued] += paths[as_parent[continued]]
+        paths += np.bincount(parents[at_depth], weights=below[at_depth], minlength=len(paths)).astype(np.int64)
+
+    candidates = np.argsort(paths)[::-1][:limit * 2 + 10]
+    candidates = candidates[paths[candidates] > 0]
+    trees = []
+    for parent_id in candidates:
+        total, depth = descendants_of(snapshot, int(parent_id))
+        trees.append({"parent_id": int(parent_id), "descendants": total, "generations": depth})
+    trees.sort(key=lambda tree: (-tree["descendants"], tree["parent_id"]))
+    return trees[:limit]
+
+
+def clusters(snapshot: GraphSnapshot, limit: int) -> dict:
+    # Компоненты связности по связям и person_identity. Узлы: родитель p -> p,
+    # ребенок c -> offset + c. Метки сливаются к меньшей (hooking) и сжимаются
+    # прыжками по указателям, пока ни одно ребро не соединяет разные метки
+    identity_children = np.flatnonzero(snapshot.identity >= 0)
+    identity_parents = snapshot.identity[identity_children].astype(np.int64)
+    offset = max(len(snapshot.indptr) - 1, int(identity_parents.max()) + 1 if len(identity_parents) else 0)
+    children = snapshot.indices.astype(np.int64)
+    u = np.concatenate([snapshot.link_parents().astype(np.int64), identity_parents])
+    v = np.concatenate([offset + children, offset + identity_children])
+    if not len(u):
+        return {"clusters": 0, "persons": 0, "largest": [], "size_distribution": []}
+
+    size = max(offset + (int(children.max()) + 1 if len(children) else 0), int(v.max()) + 1)
+    labels = np.arange(size, dtype=np.int64)
+    while True:
+        low, high = np.minimum(labels[u], labels[v]), np.maximum(labels[u], labels[v])
+        split = low != high
+        if not split.any():
+            break
+        np.minimum.at(labels, high[split], low[split])
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+    present = np.zeros(size, dtype=bool)
+    present[u] = True
+    present[v] = True
+    # Человек с записью и ребенка, и родителя - два узла, но один человек
+    persons = np.bincount(labels[present], minlength=size) - np.bincount(labels[identity_parents], minlength=size)
+    links = np.bincount(labels[snapshot.link_parents()], minlength=size)
+    roots = np.flatnonzero(present & (labels == np.arange(size)))
+    order = roots[np.lexsort((roots, -persons[roots]))][:limit]
+    sizes = np.bincount(persons[roots])
+    return {
+        "clusters": int(len(roots)),
+        "persons": int(persons[roots].sum()),
+        # Корень кластера - наименьший id родителя в нем
+        "largest": [
+            {"root_parent_id": int(root), "persons": int(persons[root]), "links": int(links[root])} for root in order
+        ],
+        "size_distribution": [{"persons": int(k), "clusters": int(n)} for k, n in enumerate(sizes) if n],
+    }
+
+
+def require_numpy():
+    if np is None:
+        raise HTTPException(status_code=503, detail="Graph analytics requires numpy")
+
+
+class GraphAnalytics:
+    def __init__(self):
+        self.snapshot: GraphSnapshot | None = None
+        self.lock = asyncio.Lock()
+        self.full_builds = 0
+        self.incremental_updates = 0
+        self.last_refresh_seconds = 0.0
+
+    async def load_links(self, db, after_rowid: int):
+        stmt = (
+            select(rowid, ParentChildAssociation.parent_id, ParentChildAssociation.child_id)
+            .select_from(ParentChildAssociation)
+            .where(rowid > after_rowid)
+        )
+        chunks = []
+        result = await db.stream(stmt)
+        async for partition in result.partitions(ANALYTICS_LOAD_CHUNK):
+            # fromiter по плоскому потоку чисел в разы быстрее np.array по списку Row
+            chunks.append(
+                np.fromiter(chain.from_iterable(partition), dtype=np.int64, count=3 * len(partition)).reshape(-1, 3)
+            )
+        if not chunks:
+            return np.zeros((0, 3), dtype=np.int64)
+        return np.concatenate(chunks)
+
+    async def load_identity(self, db):
+        rows = np.array(
+            (await db.execute(select(PersonIdentity.child_id, PersonIdentity.parent_id))).all(), dtype=np.int64
+        ).reshape(-1, 2)
+        identity = np.full(int(rows[:, 0].max()) + 1 if len(rows) else 0, -1, dtype=np.int32)
+        identity[rows[:, 0]] = rows[:, 1]
+        return identity
+
+    async def refresh(self) -> GraphSnapshot:
+        async with self.lock:
+            started = time.perf_counter()
+            async with read_session() as db:
+                # Счетчики читаем до связей: удаление, случившееся между запросами,
+                # поднимет счетчик, и следующее обновление пересоберет снимок
+                epochs = dict((await db.execute(select(GraphEpoch.name, GraphEpoch.value))).tuples().all())
+                snapshot = self.snapshot
+                if snapshot is None or snapshot.epochs != epochs:
+                    links = await self.load_links(db, 0)
+                    identity = await self.load_identity(db)
+                    snapshot = await run_in_threadpool(self.build, links, identity, epochs)
+                    self.full_builds += 1
+                else:
+                    links = await self.load_links(db, snapshot.watermark)
+                    if len(links):
+                        snapshot = await run_in_threadpool(
+                            merge_links, snapshot, links[:, 1], links[:, 2], int(links[:, 0].max())
+                        )
+                        self.incremental_updates += 1
+            self.snapshot = snapshot
+            self.last_refresh_seconds = time.perf_counter() - started
+            return snapshot
+
+    def build(self, links, identity, epochs) -> GraphSnapshot:
+        indptr, indices = build_csr(links[:, 1], links[:, 2])
+        watermark = int(links[:, 0].max()) if len(links) else 0
+        return GraphSnapshot(indptr, indices, identity, watermark, epochs)
+
+    async def compute(self, key, metric, *args):
+        require_numpy()
+        snapshot = await self.refresh()
+        if key not in snapshot.results:
+            snapshot.results[key] = await run_in_threadpool(metric, snapshot, *args)
+        return snapshot.results[key]
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        stats = {
+            "full_builds": self.full_builds,
+            "incremental_updates": self.incremental_updates,
+            "last_refresh_seconds": self.last_refresh_seconds,
+        }
+        if snapshot is not None:
+            stats.update({
+                "links": snapshot.links,
+                "watermark": snapshot.watermark,
+                "built_at": snapshot.built_at,
+                "memory_bytes": snapshot.nbytes,
+                "arrays": {
+                    name: {"length": len(array), "dtype": str(array.dtype), "bytes": array.nbytes}
+                    for name, array in snapshot.arrays().items()
+                },
+                "cached_results": len(snapshot.results),
+            })
+        return stats
+
+
+graph_analytics = GraphAnalytics()
+
+metrics.register_gauge(
+    "analytics_snapshot_bytes",
+    "memory held by the in-memory family graph snapshot",
+    lambda: graph_analytics.snapshot.nbytes if graph_analytics.snapshot is not None else 0,
+)
+
+
+router = APIRouter(prefix="/family/analytics", tags=["Analytics"])
+
+
+@router.get("/snapshot")
+async def snapshot_stats():
+    require_numpy()
+    await graph_analytics.refresh()
+    return graph_analytics.stats()
+
+
+@router.get("/children-per-parent")
+async def children_per_parent_stats():
+    return await graph_analytics.compute("children_per_parent", children_per_parent)
+
+
+@router.get("/generations")
+async def generation_stats():
+    return await graph_analytics.compute("generations", generations)
+
+
+@router.get("/clusters")
+async def cluster_stats(limit: int = Query(10, ge=1, le=ANALYTICS_MAX_TOP)):
+    return await graph_analytics.compute(("clusters", limit), clusters, limit)
+
+
+@router.get("/largest-trees")
+async def largest_tree_stats(limit: int = Query(10, ge=1, le=ANALYTICS_MAX_TOP)):
+    return await graph_analytics.compute(("largest_trees", limit), largest_trees, limit)
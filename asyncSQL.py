@@ -1,3 +1,5 @@
+import time
+IMPORT_STARTED = time.perf_counter()  # до остальных импортов: время старта пишется в лог (factory.py)
 from pydantic import BaseModel 
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
 from sqlalchemy import String, Integer, select
@@ -9,24 +11,26 @@ import routers as users_router
 import uvicorn
 
 from fastapi import APIRouter
-from db import lifespan
 import family as family_router
+import analytics
+import images
+import transfer
+import jobs
+import main as tasks_router
+import for_check
 
 
 
 from models import Parent, Child, ParentChildAssociation, ParentResponse, Family
 from db import get_db
 from family import create_family
-app = FastAPI(lifespan=lifespan)
+from cache import cache
+from factory import create_app
+router = APIRouter()
 
 
-@app.get("/")
-async def read_root():
-    return {"Hello": "World"}
 
-
-
-@app.get("/test-family")
+@router.get("/test-family")
 async def test_family_creation(db: AsyncSession = Depends(get_db)):
     # Создаем тестовые данные
     parent1 = Parent(name="Тест Родитель 1")
@@ -58,7 +62,28 @@ async def test_family_creation(db: AsyncSession = Depends(get_db)):
 
 
 
-app.include_router(users_router.router)
-app.include_router(family_router.router)
+@router.get("/cache/stats")
+async def cache_stats():
+    return cache.stats()
+
+
+# Все сервисы в одном процессе: одна сборка, один жизненный цикл, общий реестр движков.
+# Пользователи for_check живут в своей базе и смонтированы под /check,
+# чтобы их пути не пересекались с /users
+app = create_app(
+    [
+        (router, ""),
+        (users_router.router, ""),
+        (family_router.router, ""),
+        (analytics.router, ""),
+        (images.router, ""),
+        (transfer.router, ""),
+        (jobs.router, ""),
+        (tasks_router.router, ""),
+        (for_check.router, "/check"),
+    ],
+    databases=("family", "tasks", "check"),
+    import_started=IMPORT_STARTED,
+)
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
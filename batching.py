@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import os
+
+from sqlalchemy import insert
+
+
+# Group commit: одиночные INSERT из параллельных запросов собираются в пачку
+# и коммитятся одной транзакцией (один fsync вместо сотни).
+# Пачка закрывается по окну времени или по количеству строк. При окне 0 пачка
+# собирается из того, что пришло за один проход event loop и пока шел предыдущий коммит
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", "0"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "100"))
+
+
+class WriteCoalescer:
+    def __init__(self, engine, window_ms: float = WRITE_BATCH_WINDOW_MS, max_batch: int = WRITE_BATCH_MAX):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending = []
+        self.timer = None
+        self.flush_task = None
+
+    async def insert(self, table, values: dict):
+        # Возвращает вставленную строку целиком (RETURNING), поэтому refresh не нужен
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((table, values, future))
+
+        if len(self.pending) >= self.max_batch:
+            self.start_flush()
+        elif self.timer is None and self.flush_task is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.start_flush)
+
+        return await future
+
+    def start_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # Пока идет сброс, новые строки копятся и уйдут следующей пачкой
+        # Задача запускается с пустым контекстом: пачка общая и не должна
+        # числиться за тем HTTP-запросом, который случайно ее открыл (см. metrics.py)
+        if self.flush_task is None:
+            self.flush_task = contextvars.Context().run(asyncio.create_task, self.flush())
+
+    async def flush(self):
+        try:
+            while self.pending:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                await self.commit_batch(batch)
+        finally:
+            self.flush_task = None
+
+    async def commit_batch(self, batch):
+        # Строки одной таблицы с одинаковым набором колонок пишем одним многострочным INSERT
+        groups = {}
+        for item in batch:
+            table, values, _ = item
+            groups.setdefault((table, tuple(values)), []).append(item)
+
+        results = []
+        try:
+            async with self.engine.begin() as conn:
+                for (table, _), items in groups.items():
+                    results.extend(await self.insert_group(conn, table, items))
+        except Exception as e:
+            # Не удался сам коммит - не записалась ни одна строка
+            results = [(future, None, e) for _, _, future in batch]
+
+        for future, row, error in results:
+            if future.done():  # вызывающий уже отменил запрос
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(row)
+
+    async def insert_group(self, conn, table, items):
+        stmt = insert(table).returning(*table.c, sort_by_parameter_order=True)
+        try:
+            async with conn.begin_nested():
+                rows = (await conn.execute(stmt, [values for _, values, _ in items])).all()
+            return [(future, row, None) for (_, _, future), row in zip(items, rows)]
+        except Exception:
+            pass
+
+        # В пачке есть плохая строка: пишем по одной, каждую в своем SAVEPOINT,
+        # чтобы ошибка одной не откатила остальные
+        results = []
+        for _, values, future in items:
+            try:
+                async with conn.begin_nested():
+                    row = (await conn.execute(insert(table).values(**values).returning(*table.c))).one()
+                results.append((future, row, None))
+            except Exception as e:
+                results.append((future, None, e))
+        return results
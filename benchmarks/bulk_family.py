@@ -0,0 +1,76 @@
+# Сравнение скорости записи связей: старый create_family (db.add на каждую пару)
+# против пакетного insert_links из POST /family/bulk.
+# Запуск из корня репозитория: python -m benchmarks.bulk_family --families 10000
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db import Base
+from family import create_family, family_pairs, insert_links
+from models import Child, Family, Parent
+
+
+def make_families(count: int, children_per_family: int) -> list[Family]:
+    families = []
+    for i in range(count):
+        first_child = i * children_per_family + 1
+        families.append(Family(
+            parent1=2 * i + 1,
+            parent2=2 * i + 2,
+            children=list(range(first_child, first_child + children_per_family))
+        ))
+    return families
+
+
+async def fresh_session_factory(path: str, families: int, children_per_family: int):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(Parent), [{"name": f"parent {i}"} for i in range(2 * families)])
+        await conn.execute(insert(Child), [{"name": f"child {i}"} for i in range(families * children_per_family)])
+    return engine, async_sessionmaker(bind=engine, expire_on_commit=False)
+
+
+async def run_per_object(families: list[Family], session_factory) -> None:
+    # create_family коммитит сам, по одной семье за вызов, как это сделал бы клиент
+    async with session_factory() as db:
+        for family in families:
+            await create_family(family, db)
+
+
+async def run_bulk(families: list[Family], session_factory) -> None:
+    pairs = list(dict.fromkeys(pair for family in families for pair in family_pairs(family)))
+    async with session_factory() as db:
+        await insert_links(pairs, db)
+        await db.commit()
+
+
+async def measure(name: str, runner, args) -> None:
+    families = make_families(args.families, args.children)
+    rows = sum(len(family_pairs(family)) for family in families)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, session_factory = await fresh_session_factory(
+            os.path.join(tmp, "bench.db"), args.families, args.children
+        )
+        started = time.perf_counter()
+        await runner(families, session_factory)
+        elapsed = time.perf_counter() - started
+        await engine.dispose()
+    print(f"{name:<12} rows={rows:<8} time={elapsed:8.3f}s  rows/sec={rows / elapsed:12.0f}")
+
+
+async def main(args) -> None:
+    await measure("per-object", run_per_object, args)
+    await measure("bulk", run_bulk, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="create_family vs POST /family/bulk insert path")
+    parser.add_argument("--families", type=int, default=2000)
+    parser.add_argument("--children", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,118 @@
+# Аналитика по всему графу семей: обход ORM-связей Parent.children против снимка CSR (analytics.py).
+# Меряется полная сборка снимка, дочитывание новых связей и каждая метрика отдельно.
+# Запуск из корня репозитория: python -m benchmarks.graph_analytics --couples 50000 --generations 6
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.harness import executemany_chunked, open_seed_connection
+
+
+def make_graph(couples: int, generations: int, seed: int = 1):
+    # Первое поколение - 2 * couples родителей; в каждом следующем родители - дети прошлого
+    # поколения, получившие запись родителя (person_identity). Дети: 0-3 на пару
+    rng = random.Random(seed)
+    parents = list(range(1, 2 * couples + 1))
+    next_parent = len(parents) + 1
+    next_child = 1
+    links, identity = [], []
+    for _ in range(generations):
+        rng.shuffle(parents)
+        grown = []
+        for i in range(0, len(parents) - 1, 2):
+            for _ in range(rng.randint(0, 3)):
+                links.append((parents[i], next_child))
+                links.append((parents[i + 1], next_child))
+                if rng.random() < 0.6:
+                    identity.append((next_child, next_parent))
+                    grown.append(next_parent)
+                    next_parent += 1
+                next_child += 1
+        parents = grown
+    return next_parent - 1, next_child - 1, links, identity
+
+
+def seed(path: str, parents: int, children: int, links, identity) -> None:
+    conn = open_seed_connection(path)
+    with conn:
+        executemany_chunked(conn, "INSERT INTO parents (name) VALUES (?)", ((f"parent {i}",) for i in range(parents)))
+        executemany_chunked(conn, "INSERT INTO children (name) VALUES (?)", ((f"child {i}",) for i in range(children)))
+        executemany_chunked(conn, "INSERT INTO association (parent_id, child_id) VALUES (?, ?)", links)
+        executemany_chunked(conn, "INSERT INTO person_identity (child_id, parent_id) VALUES (?, ?)", identity)
+    conn.close()
+
+
+async def timed(name: str, coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    print(f"{name:<28} {time.perf_counter() - started:9.3f}s")
+    return result
+
+
+async def orm_children_per_parent(read_session, Parent, selectinload, select):
+    async with read_session() as db:
+        parents = (await db.scalars(select(Parent).options(selectinload(Parent.children)))).all()
+        return sorted(len(parent.children) for parent in parents if parent.children)
+
+
+async def main(args) -> None:
+    tmp = tempfile.mkdtemp(prefix="appi-analytics-")
+    path = os.path.join(tmp, "family.db")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+
+    from sqlalchemy import select
+    from sqlalchemy.orm import selectinload
+
+    import analytics
+    from db import family_db, family_schema, read_session
+    from models import Parent
+    from schema import ensure_schema
+
+    await ensure_schema(family_db.write_engine, family_schema)
+    await family_db.dispose()  # заливка переключает журнал, ей нужна база без других соединений
+    parents, children, links, identity = make_graph(args.couples, args.generations)
+    started = time.perf_counter()
+    seed(path, parents, children, links, identity)
+    print(f"seeded parents={parents} children={children} links={len(links)} identity={len(identity)} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    graph = analytics.graph_analytics
+    if not args.skip_orm:
+        await timed("orm children-per-parent", orm_children_per_parent(read_session, Parent, selectinload, select))
+    await timed("snapshot full build", graph.refresh())
+    await timed("children-per-parent", graph.compute("children_per_parent", analytics.children_per_parent))
+    await timed("generations", graph.compute("generations", analytics.generations))
+    await timed("clusters", graph.compute(("clusters", 10), analytics.clusters, 10))
+    await timed("largest-trees", graph.compute(("largest_trees", 10), analytics.largest_trees, 10))
+    await timed("cached repeat", graph.compute(("clusters", 10), analytics.clusters, 10))
+
+    # Новые семьи поверх существующего графа: снимок дочитывает только их
+    conn = sqlite3.connect(path)
+    with conn:
+        first_child = children + 1
+        executemany_chunked(conn, "INSERT INTO children (name) VALUES (?)", (("new",) for _ in range(args.incremental)))
+        executemany_chunked(
+            conn, "INSERT INTO association (parent_id, child_id) VALUES (?, ?)",
+            ((random.randint(1, parents), child_id) for child_id in range(first_child, first_child + args.incremental)),
+        )
+    conn.close()
+    await timed(f"incremental +{args.incremental} links", graph.refresh())
+    await timed("children-per-parent", graph.compute("children_per_parent", analytics.children_per_parent))
+
+    stats = graph.stats()
+    print(f"full_builds={stats['full_builds']} incremental_updates={stats['incremental_updates']} "
+          f"links={stats['links']} memory={stats['memory_bytes'] / 1024 / 1024:.1f} MiB")
+    await family_db.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORM walk vs CSR snapshot for whole-graph analytics")
+    parser.add_argument("--couples", type=int, default=50_000)
+    parser.add_argument("--generations", type=int, default=6)
+    parser.add_argument("--incremental", type=int, default=1_000)
+    parser.add_argument("--skip-orm", action="store_true", help="не мерить обход ORM (долго на больших графах)")
+    asyncio.run(main(parser.parse_args()))
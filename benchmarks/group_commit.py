@@ -0,0 +1,78 @@
+# Пропускная способность и задержка одиночных вставок: коммит на каждый запрос
+# против WriteCoalescer (group commit) при разной конкурентности.
+# Запуск из корня репозитория: python -m benchmarks.group_commit --inserts 2000
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from batching import WriteCoalescer
+from db import Base, apply_pragmas
+from models import Parent
+
+
+async def per_request_commit(engine, table, values):
+    # То, что раньше делал create_parent: своя транзакция и свой коммит на каждую строку
+    async with engine.begin() as conn:
+        return (await conn.execute(insert(table).values(**values).returning(*table.c))).one()
+
+
+async def run_level(path: str, mode: str, concurrency: int, inserts: int, args) -> dict:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=1, max_overflow=0)
+    apply_pragmas(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    table = Parent.__table__
+    coalescer = WriteCoalescer(engine, window_ms=args.window_ms, max_batch=args.max_batch)
+    latencies = []
+    counter = iter(range(inserts))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            if mode == "coalesced":
+                await coalescer.insert(table, {"name": f"parent {i}"})
+            else:
+                await per_request_commit(engine, table, {"name": f"parent {i}"})
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "rows_per_sec": inserts / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(args) -> None:
+    print(f"{'mode':<12}{'conc':>6}{'rows/sec':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for concurrency in args.concurrency:
+        for mode in ("per-request", "coalesced"):
+            with tempfile.TemporaryDirectory() as tmp:
+                result = await run_level(os.path.join(tmp, "bench.db"), mode, concurrency, args.inserts, args)
+            print(
+                f"{result['mode']:<12}{result['concurrency']:>6}{result['rows_per_sec']:>12.0f}"
+                f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-request commit vs group commit")
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--window-ms", type=float, default=0)
+    parser.add_argument("--max-batch", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,339 @@
+# Нагрузочный стенд для всех трех приложений: asyncSQL.app (routers + family), main.app и for_check.app.
+# Приложения гоняются в том же процессе через httpx.ASGITransport, каждое на свежей временной базе.
+# Результат - JSON с пропускной способностью и p50/p95/p99 по каждому эндпоинту.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.harness --dataset small --concurrency 1 10 50 --requests 2000 --out bench.json
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy import create_engine
+
+
+# Размеры наборов: родители, дети, связи (у ребенка максимум два родителя), задачи, пользователи
+DATASETS = {
+    "small": {"parents": 1_000, "children": 1_000, "links": 2_000, "tasks": 1_000, "users": 1_000},
+    "medium": {"parents": 100_000, "children": 100_000, "links": 200_000, "tasks": 100_000, "users": 100_000},
+    "large": {"parents": 1_000_000, "children": 1_000_000, "links": 2_000_000, "tasks": 1_000_000, "users": 1_000_000},
+}
+
+SEED_CHUNK = 50_000
+# Доля детей, которых заливка оставляет без родителей: в них пишет сценарий POST /family/link.
+# Иначе у каждого ребенка уже два родителя, и все запросы на связь заканчиваются 409
+UNLINKED_CHILDREN_SHARE = 0.25
+
+
+def executemany_chunked(conn: sqlite3.Connection, sql: str, rows) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SEED_CHUNK:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def open_seed_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    # Для заливки не нужна надежность: журнал в памяти и без fsync
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    return conn
+
+
+def linked_children(size: dict) -> int:
+    return size["children"] - int(size["children"] * UNLINKED_CHILDREN_SHARE)
+
+
+def link_pair(i: int, parents: int) -> tuple[int, int]:
+    # i-я связь: ребенок i // 2 + 1 получает родителей c и c + parents/2 (по модулю числа родителей)
+    child_id = i // 2 + 1
+    parent_id = (child_id - 1 + (i % 2) * max(1, parents // 2)) % parents + 1
+    return parent_id, child_id
+
+
+def seed_family(path: str, size: dict) -> None:
+    from db import Base
+    import models  # noqa: F401 - регистрирует таблицы в Base.metadata
+
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    parents, children = size["parents"], size["children"]
+    conn = open_seed_connection(path)
+    with conn:
+        executemany_chunked(conn, "INSERT INTO parents (name) VALUES (?)", ((f"parent {i}",) for i in range(parents)))
+        executemany_chunked(conn, "INSERT INTO children (name) VALUES (?)", ((f"child {i}",) for i in range(children)))
+
+        def links():
+            for i in range(min(size["links"], 2 * linked_children(size))):
+                yield link_pair(i, parents)
+
+        executemany_chunked(conn, "INSERT OR IGNORE INTO association (parent_id, child_id) VALUES (?, ?)", links())
+        executemany_chunked(
+            conn,
+            "INSERT INTO users (name, email, password, image) VALUES (?, ?, ?, ?)",
+            ((f"user {i}", f"user{i}@example.com", "secret", "image.png") for i in range(size["users"])),
+        )
+    conn.close()
+
+
+def seed_tasks(path: str, size: dict) -> None:
+    import main
+
+    sync_engine = create_engine(f"sqlite:///{path}")
+    main.Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    conn = open_seed_connection(path)
+    with conn:
+        executemany_chunked(
+            conn,
+            "INSERT INTO tasks (id, category, title, description, status, priority, deadline, percent, deadline_on) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (i, f"category {i % 20}", f"task {i}", "description", i % 3 == 0, i % 5,
+                 f"2024-{i % 28 + 1:02d}-{i % 12 + 1:02d}", i % 101, f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}")
+                for i in range(1, size["tasks"] + 1)
+            ),
+        )
+    conn.close()
+
+
+def seed_check(path: str, size: dict) -> None:
+    import for_check
+
+    sync_engine = create_engine(f"sqlite:///{path}")
+    for_check.Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+
+    conn = open_seed_connection(path)
+    with conn:
+        executemany_chunked(
+            conn,
+            "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
+            ((f"user {i}", f"user{i}@example.com", "secret") for i in range(size["users"])),
+        )
+    conn.close()
+
+
+class Counter:
+    def __init__(self, start: int):
+        self.value = start
+
+    def next(self) -> int:
+        self.value += 1
+        return self.value
+
+
+# Сценарии: (имя эндпоинта, вес, "read"/"write", функция -> (метод, путь, параметры, json)).
+# Эндпоинты, которые всегда отдают всю таблицу (/tasks/alltasks, /users/all_users у for_check),
+# в смесь не входят: на больших наборах они занимают весь прогон
+def family_workload(size: dict):
+    rand = random.randint
+    parents, children = size["parents"], size["children"]
+    # Связи продолжают заливку: следующий слот у детей без родителей. Когда свободные
+    # дети кончатся, ответы станут 404 - они видны в non_2xx отчета
+    free_links = Counter(2 * linked_children(size) - 1)
+    return [
+        ("GET /family/all_parents", 10, "read",
+         lambda: ("GET", "/family/all_parents", {"after_id": rand(0, parents), "limit": 100}, None)),
+        ("GET /family/parent/{id}", 20, "read",
+         lambda: ("GET", f"/family/parent/{rand(1, parents)}", None, None)),
+        ("GET /family/get_children/{id}", 20, "read",
+         lambda: ("GET", f"/family/get_children/{rand(1, parents)}", None, None)),
+        ("GET /family/get_parents/{id}", 10, "read",
+         lambda: ("GET", f"/family/get_parents/{rand(1, children)}", None, None)),
+        ("GET /family/descendants/{id}", 5, "read",
+         lambda: ("GET", f"/family/descendants/{rand(1, parents)}", {"max_depth": 3}, None)),
+        ("GET /family/link/dump", 5, "read",
+         lambda: ("GET", "/family/link/dump", {"after_parent_id": rand(0, parents), "limit": 100}, None)),
+        ("GET /users/users/{id}", 10, "read",
+         lambda: ("GET", f"/users/users/{rand(1, size['users'])}", None, None)),
+        ("POST /family/create_parent", 5, "write",
+         lambda: ("POST", "/family/create_parent", {"name": "bench parent"}, None)),
+        ("POST /family/create_child", 5, "write",
+         lambda: ("POST", "/family/create_child", {"name": "bench child"}, None)),
+        ("POST /family/link/{p}/{c}", 5, "write",
+         lambda: ("POST", "/family/link/{}/{}".format(*link_pair(free_links.next(), parents)), None, None)),
+        ("POST /users/users", 5, "write",
+         lambda: ("POST", "/users/users", None,
+                  {"name": "bench", "email": "bench@example.com", "password": "secret", "image": "image.png"})),
+    ]
+
+
+def tasks_workload(size: dict):
+    rand = random.randint
+    ids = Counter(size["tasks"])
+    return [
+        ("GET /tasks", 60, "read",
+         lambda: ("GET", "/tasks", {"after_id": rand(0, size["tasks"]), "limit": 100}, None)),
+        ("POST /tasks", 40, "write",
+         lambda: ("POST", "/tasks", None,
+                  {"id": ids.next(), "category": "bench", "title": "bench", "description": "bench",
+                   "status": False, "priority": 1, "deadline": "2024-15-06", "percent": 0})),
+    ]
+
+
+def check_workload(size: dict):
+    rand = random.randint
+    user = {"name": "bench", "email": "bench@example.com", "password": "secret"}
+    return [
+        ("GET /users/{id}", 60, "read",
+         lambda: ("GET", f"/users/{rand(1, size['users'])}", None, None)),
+        ("POST /users", 20, "write", lambda: ("POST", "/users", None, user)),
+        ("PUT /users/{id}", 20, "write", lambda: ("PUT", f"/users/{rand(1, size['users'])}", None, user)),
+    ]
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: dict, elapsed: float) -> dict:
+    report = {}
+    for name, (latencies, statuses) in sorted(samples.items()):
+        latencies.sort()
+        report[name] = {
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "status_counts": {str(code): count for code, count in sorted(statuses.items())},
+            "errors": sum(count for code, count in statuses.items() if code >= 500),
+            # 4xx и 5xx: задержки ошибок не смешиваются незаметно с задержками успешных ответов
+            "non_2xx": sum(count for code, count in statuses.items() if not 200 <= code < 300),
+        }
+    return report
+
+
+async def run_level(app, workload, concurrency: int, requests: int, read_ratio: float | None) -> dict:
+    if read_ratio is not None:
+        # Переопределяем долю чтений, сохраняя пропорции внутри групп
+        reads = [item for item in workload if item[2] == "read"]
+        writes = [item for item in workload if item[2] == "write"]
+        read_total = sum(item[1] for item in reads) or 1
+        write_total = sum(item[1] for item in writes) or 1
+        weights = [item[1] / read_total * read_ratio for item in reads]
+        weights += [item[1] / write_total * (1 - read_ratio) for item in writes]
+        workload = reads + writes
+    else:
+        weights = [item[1] for item in workload]
+
+    samples = {name: ([], {}) for name, _, _, _ in workload}
+    remaining = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient):
+        for _ in remaining:
+            name, _, _, build = random.choices(workload, weights)[0]
+            method, path, params, body = build()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                code = response.status_code
+            except Exception:
+                code = 599
+            latencies, statuses = samples[name]
+            latencies.append(time.perf_counter() - started)
+            statuses[code] = statuses.get(code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    endpoints = summarize({name: data for name, data in samples.items() if data[0]}, elapsed)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "elapsed_sec": elapsed,
+        "rps": requests / elapsed,
+        "non_2xx": sum(endpoint["non_2xx"] for endpoint in endpoints.values()),
+        "endpoints": endpoints,
+    }
+
+
+APPS = {
+    # имя: (модуль, переменная окружения с URL базы, префикс URL, функция заливки, сценарий)
+    "family": ("asyncSQL", "DATABASE_URL", "sqlite+aiosqlite:///", seed_family, family_workload),
+    "tasks": ("main", "TASKS_DATABASE_URL", "sqlite+aiosqlite:///", seed_tasks, tasks_workload),
+    "check": ("for_check", "CHECK_DATABASE_URL", "sqlite+aiosqlite:///", seed_check, check_workload),
+}
+
+
+async def main(args) -> dict:
+    size = dict(DATASETS[args.dataset])
+    for key in size:
+        override = getattr(args, key)
+        if override is not None:
+            size[key] = override
+
+    tmp = tempfile.mkdtemp(prefix="appi-bench-")
+    # URL баз задаются до импорта приложений: движки создаются при импорте модулей
+    for name, (_, env_name, prefix, _, _) in APPS.items():
+        os.environ[env_name] = prefix + os.path.join(tmp, f"{name}.db")
+
+    report = {"dataset": args.dataset, "size": size, "python": sys.version.split()[0], "apps": {}}
+    for name in args.apps:
+        module_name, env_name, prefix, seed, workload_factory = APPS[name]
+        path = os.environ[env_name][len(prefix):]
+
+        started = time.perf_counter()
+        seed(path, size)
+        seed_sec = time.perf_counter() - started
+        print(f"[{name}] seeded in {seed_sec:.1f}s", file=sys.stderr)
+
+        app = importlib.import_module(module_name).app
+        workload = workload_factory(size)
+        levels = []
+        async with app.router.lifespan_context(app):
+            for concurrency in args.concurrency:
+                level = await run_level(app, workload, concurrency, args.requests, args.read_ratio)
+                print(
+                    f"[{name}] concurrency={concurrency} rps={level['rps']:.0f} non_2xx={level['non_2xx']}",
+                    file=sys.stderr,
+                )
+                levels.append(level)
+        report["apps"][name] = {"seed_sec": seed_sec, "levels": levels}
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process load test for asyncSQL.app, main.app and for_check.app")
+    parser.add_argument("--apps", nargs="+", choices=list(APPS), default=list(APPS))
+    parser.add_argument("--dataset", choices=list(DATASETS), default="small")
+    for key in DATASETS["small"]:
+        parser.add_argument(f"--{key}", type=int, default=None, help=f"override dataset {key} count")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--read-ratio", type=float, default=None, help="share of read requests, 0..1")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible request mixes")
+    parser.add_argument("--out", default=None, help="write JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    result = asyncio.run(main(args))
+    output = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        print(output)
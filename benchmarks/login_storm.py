@@ -0,0 +1,85 @@
+# Задержка посторонних эндпоинтов во время шторма логинов: scrypt в пуле процессов
+# против scrypt прямо в event loop (PASSWORD_HASH_WORKERS=0).
+# Запуск из корня репозитория: python -m benchmarks.login_storm --storm 32 --seconds 5
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list[float]) -> None:
+    # Дешевый эндпоинт без пароля: его задержка и показывает, свободен ли event loop
+    while not stop.is_set():
+        started = time.perf_counter()
+        (await client.get("/family/all_parents", params={"limit": 10})).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+
+
+async def login_loop(client: httpx.AsyncClient, stop: asyncio.Event, counts: dict) -> None:
+    while not stop.is_set():
+        response = await client.post("/users/login", json={"email": "storm@example.com", "password": "secret"})
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def run_phase(app, name: str, storm: int, seconds: float) -> None:
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    counts: dict[int, int] = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        tasks = [asyncio.create_task(probe(client, stop, latencies))]
+        tasks += [asyncio.create_task(login_loop(client, stop, counts)) for _ in range(storm)]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    logins = sum(counts.values())
+    print(
+        f"{name:<14} probe p50={statistics.median(latencies) * 1000:8.2f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:8.2f}ms n={len(latencies):<5} "
+        f"logins/s={logins / seconds:7.1f} statuses={dict(sorted(counts.items()))}"
+    )
+
+
+async def main(args) -> None:
+    tmp = tempfile.mkdtemp(prefix="appi-login-")
+    # asyncSQL.app поднимает все базы реестра - все они во временном каталоге
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'family.db')}"
+    os.environ["TASKS_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'tasks.db')}"
+    os.environ["CHECK_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'check.db')}"
+
+    import asyncSQL
+    from passwords import hasher
+
+    app = asyncSQL.app
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for i in range(10):
+                await client.post("/family/create_parent", params={"name": f"parent {i}"})
+            (await client.post("/users/users", json={
+                "name": "storm", "email": "storm@example.com", "password": "secret", "image": "image.png"
+            })).raise_for_status()
+
+        workers = hasher.workers
+        print(f"pool workers={workers}, storm={args.storm} concurrent logins, {args.seconds}s per phase")
+        await run_phase(app, "idle", 0, args.seconds)
+        await run_phase(app, "storm, pool", args.storm, args.seconds)
+        hasher.workers = 0  # то же, что PASSWORD_HASH_WORKERS=0: хэш на event loop
+        await run_phase(app, "storm, inline", args.storm, args.seconds)
+        hasher.workers = workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Unrelated endpoint latency under a login storm")
+    parser.add_argument("--storm", type=int, default=32, help="concurrent login loops")
+    parser.add_argument("--seconds", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,99 @@
+# Списочные эндпоинты: быстрый путь (колонки-кортежи + orjson, см. serialization.py)
+# против прежнего (ORM-объекты -> response_model -> pydantic-валидация каждой строки -> json).
+# Прежние реализации собраны здесь на отдельном приложении поверх тех же баз.
+# Запуск из корня репозитория: python -m benchmarks.serialization --rows 1000 --requests 200
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import select, text
+
+from benchmarks.harness import seed_family, seed_tasks
+
+
+def baseline_app(read_session, task_session, models, tasks_module) -> FastAPI:
+    baseline = FastAPI()
+
+    @baseline.get("/family/all_parents", response_model=list[models.ParentResponse])
+    async def read_parents(limit: int):
+        async with read_session() as db:
+            return (await db.execute(select(models.Parent).order_by(models.Parent.id).limit(limit))).scalars().all()
+
+    @baseline.get("/users/all_users", response_model=list[models.UserResponse])
+    async def get_all_users(limit: int):
+        async with read_session() as db:
+            return (await db.execute(select(models.User).order_by(models.User.id).limit(limit))).scalars().all()
+
+    @baseline.get("/tasks", response_model=list[tasks_module.TaskSchema])
+    async def get_tasks(limit: int):
+        async with task_session() as session:
+            Task = tasks_module.Task
+            return (await session.execute(select(Task).order_by(Task.id).limit(limit))).scalars().all()
+
+    @baseline.get("/tasks/alltasks")
+    async def get_all_tasks():
+        async with task_session() as session:
+            result = await session.execute(text(
+                "SELECT id, category, title, description, status, priority, deadline, percent FROM tasks"
+            ))
+            tasks_list = [dict(task) for task in result.mappings().all()]
+            return {"status": "success", "data": tasks_list, "count": len(tasks_list)}
+
+    return baseline
+
+
+async def measure(app, path: str, params: dict, requests: int) -> tuple[float, int]:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        response = await client.get(path, params=params)  # прогрев: кэш страниц SQLite, компиляция запроса
+        response.raise_for_status()
+        started = time.perf_counter()
+        for _ in range(requests):
+            (await client.get(path, params=params)).raise_for_status()
+        return (time.perf_counter() - started) / requests, len(response.content)
+
+
+async def main(args) -> None:
+    tmp = tempfile.mkdtemp(prefix="appi-serialization-")
+    family_db = os.path.join(tmp, "family.db")
+    tasks_db = os.path.join(tmp, "tasks.db")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{family_db}"
+    os.environ["TASKS_DATABASE_URL"] = f"sqlite+aiosqlite:///{tasks_db}"
+    os.environ["CHECK_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tmp, 'check.db')}"
+
+    size = {"parents": args.rows, "children": 0, "links": 0, "tasks": args.rows, "users": args.rows}
+    seed_family(family_db, size)
+    seed_tasks(tasks_db, size)
+
+    import asyncSQL
+    import db
+    import main as tasks_module
+    import models
+    import serialization
+
+    print(f"encoder: {'orjson' if serialization.orjson is not None else 'json'}, rows per response: {args.rows}")
+    baseline = baseline_app(db.read_session, tasks_module.read_session, models, tasks_module)
+    endpoints = [
+        (asyncSQL.app, "/family/all_parents", "/family/all_parents", {"limit": args.rows}),
+        (asyncSQL.app, "/users/users/all_users", "/users/all_users", {"limit": args.rows}),
+        (asyncSQL.app, "/tasks", "/tasks", {"limit": args.rows}),
+        (asyncSQL.app, "/tasks/alltasks", "/tasks/alltasks", {"limit": args.rows}),
+    ]
+    async with asyncSQL.app.router.lifespan_context(asyncSQL.app):
+        for app, path, baseline_path, params in endpoints:
+            old, old_size = await measure(baseline, baseline_path, params, args.requests)
+            new, new_size = await measure(app, path, params, args.requests)
+            print(
+                f"{path:<24} old={old * 1000:8.2f}ms  new={new * 1000:8.2f}ms  "
+                f"x{old / new:4.1f}  bytes {old_size}/{new_size}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List endpoints: fast serialization path vs ORM + pydantic")
+    parser.add_argument("--rows", type=int, default=1000, help="rows in the table and per response")
+    parser.add_argument("--requests", type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
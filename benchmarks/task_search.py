@@ -0,0 +1,106 @@
+# Поиск по задачам: GET /tasks/search (FTS5, bm25) против LIKE-скана по title и description,
+# к которому сводился поиск через /tasks/alltasks. like и fts - первые --limit совпадений
+# без ранжирования, bm25 - как в эндпоинте: все совпадения, отсортированные по релевантности.
+# Запуск из корня репозитория: python -m benchmarks.task_search --tasks 50000
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+WORDS = (
+    "report deploy invoice review budget meeting release backup migrate server client "
+    "design testing payment contract schedule support update security audit database "
+    "отчет релиз бюджет встреча сервер клиент договор оплата проверка резервная копия"
+).split()
+# Основная масса слов - случайный "шум", чтобы искомые слова встречались в ~1% задач
+FILLER = [f"w{n}" for n in range(5000)]
+VOCABULARY = WORDS + FILLER
+
+LIKE_SQL = """
+    SELECT id, title FROM tasks
+    WHERE title LIKE ?1 OR description LIKE ?1
+    LIMIT ?2
+"""
+
+FTS_FIRST_SQL = """
+    SELECT t.id, t.title
+    FROM tasks_fts JOIN tasks AS t ON t.id = tasks_fts.rowid
+    WHERE tasks_fts MATCH ?1
+    LIMIT ?2
+"""
+
+FTS_SQL = """
+    SELECT t.id, t.title, bm25(tasks_fts, 10.0, 1.0) AS rank
+    FROM tasks_fts JOIN tasks AS t ON t.id = tasks_fts.rowid
+    WHERE tasks_fts MATCH ?1
+    ORDER BY rank
+    LIMIT ?2
+"""
+
+
+def sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(length))
+
+
+def seed(path: str, count: int, seed_value: int) -> None:
+    import main
+
+    sync_engine = create_engine(f"sqlite:///{path}")
+    with sync_engine.begin() as conn:
+        main.Base.metadata.create_all(conn)
+        main.migrate_tasks(conn)
+    sync_engine.dispose()
+
+    rng = random.Random(seed_value)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO tasks (id, title, description, status, percent) VALUES (?, ?, ?, ?, ?)",
+            (
+                (i, sentence(rng, 5) + f" #{i}", sentence(rng, 40), i % 3 == 0, i % 101)
+                for i in range(1, count + 1)
+            ),
+        )
+    conn.close()
+
+
+def measure(conn, name: str, word: str, sql: str, term: str, args) -> float:
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        rows = conn.execute(sql, (term, args.limit)).fetchall()
+    elapsed = (time.perf_counter() - started) / args.repeat
+    print(f"{name:<6} term={word:<14} rows={len(rows):<5} time={elapsed * 1000:9.3f}ms")
+    return elapsed
+
+
+def main(args) -> None:
+    import main as tasks_app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        started = time.perf_counter()
+        seed(path, args.tasks, args.seed)
+        print(f"seeded {args.tasks} tasks (with FTS triggers) in {time.perf_counter() - started:.2f}s")
+
+        conn = sqlite3.connect(path)
+        for word in args.terms:
+            like = measure(conn, "like", word, LIKE_SQL, f"%{word}%", args)
+            match = tasks_app.fts_query(word, False)
+            fts = measure(conn, "fts", word, FTS_FIRST_SQL, match, args)
+            measure(conn, "bm25", word, FTS_SQL, match, args)
+            print(f"       like / fts: x{like / fts:.1f}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FTS5 search vs LIKE scan over tasks")
+    parser.add_argument("--tasks", type=int, default=50000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--terms", nargs="+", default=["invoice", "отчет", "#49999"])
+    main(parser.parse_args())
@@ -0,0 +1,98 @@
+import os
+import time
+from collections import OrderedDict
+
+
+# Внутрипроцессный LRU-кэш для частых точечных чтений (родитель, ребенок, их связи).
+# Ключи - кортежи вида (вид, id...), например ("parent", 1), ("children_of", 1).
+# Пишущие эндпоинты обязаны сбрасывать затронутые ключи сами.
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "0")) or None  # секунды, 0 - без TTL
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: float | None = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Растет при каждом сбросе. Если во время загрузки значения произошла запись,
+        # загруженное значение могло устареть, и класть его в кэш нельзя
+        self.generation = 0
+
+    def get(self, key):
+        entry = self.data.get(key, MISSING)
+        if entry is MISSING:
+            self.misses += 1
+            return MISSING
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self.data[key]
+            self.misses += 1
+            return MISSING
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, generation: int | None = None):
+        if generation is not None and generation != self.generation:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self.data[key] = (value, expires_at)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is MISSING:
+            generation = self.generation
+            value = await loader()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, *keys):
+        self.generation += 1
+        for key in keys:
+            if self.data.pop(key, MISSING) is not MISSING:
+                self.invalidations += 1
+
+    def invalidate_kind(self, *kinds: str):
+        # Для массовых удалений: сбрасываем все ключи указанных видов
+        self.generation += 1
+        for key in [key for key in self.data if key[0] in kinds]:
+            del self.data[key]
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self.data)
+        self.data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+cache = LRUCache()
+
+
+def invalidate_link(parent_id: int, child_id: int):
+    cache.invalidate(("children_of", parent_id), ("parents_of", child_id))
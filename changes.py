@@ -0,0 +1,269 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import time
+from collections import deque
+
+from fastapi import APIRouter, FastAPI, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Float, Integer, String, Text, delete, insert, select
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
+from db import engines
+from metrics import metrics
+from schema import Schema
+from serialization import dumps
+
+
+# Лента изменений вместо опроса GET /tasks и /family/link/dump. Каждый пишущий эндпоинт
+# после коммита публикует короткое событие с растущим номером seq; события лежат в кольцевом
+# буфере в памяти, подписчики читают их по SSE (GET /changes). Буфер общий: у подписчика
+# только курсор (последний отданный seq), поэтому медленный клиент не копит очередь в памяти -
+# он просто отстает, а если отстал дальше начала буфера, получает событие reset
+# (перечитать списки целиком) и продолжает с текущего места. Переподключение с Last-Event-ID
+# досылает пропущенное из буфера. С CHANGES_LOG=1 события еще и пишутся пачками в таблицу
+# change_log (отдельная база): по ней можно догнать отставание больше буфера и пережить рестарт.
+# Без журнала id событий меняются с каждым запуском, и старый Last-Event-ID дает reset.
+# Лента живет в процессе: запускать приложение с ней одним воркером, как и условные GET
+CHANGES_BUFFER_SIZE = int(os.getenv("CHANGES_BUFFER_SIZE", "10000"))
+CHANGES_HEARTBEAT = float(os.getenv("CHANGES_HEARTBEAT", "15"))
+CHANGES_SEND_BATCH = int(os.getenv("CHANGES_SEND_BATCH", "500"))
+CHANGES_MAX_ITEMS = int(os.getenv("CHANGES_MAX_ITEMS", "100"))  # пар в одном событии о связях
+CHANGES_LOG = os.getenv("CHANGES_LOG", "0") == "1"
+CHANGES_DATABASE_URL = os.getenv("CHANGES_DATABASE_URL", "sqlite+aiosqlite:///./changes.db")
+CHANGES_LOG_FLUSH_MS = float(os.getenv("CHANGES_LOG_FLUSH_MS", "50"))
+CHANGES_LOG_RETENTION = int(os.getenv("CHANGES_LOG_RETENTION", "1000000"))
+
+logger = logging.getLogger("changes")
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    topic: Mapped[str] = mapped_column(String(20))
+    created_at: Mapped[float] = mapped_column(Float)
+    payload: Mapped[str] = mapped_column(Text)  # событие целиком, как его видит клиент
+
+
+changes_schema = Schema("changes", Base.metadata)
+changes_db = engines.register("changes", CHANGES_DATABASE_URL, changes_schema) if CHANGES_LOG else None
+
+
+class ChangeEvent:
+    __slots__ = ("seq", "topic", "data")
+
+    def __init__(self, seq: int, topic: str, data: bytes):
+        self.seq = seq
+        self.topic = topic
+        self.data = data  # JSON события, сериализуется один раз на всех подписчиков
+
+
+class ChangeFeed:
+    def __init__(self, size: int = CHANGES_BUFFER_SIZE):
+        self.buffer: deque[ChangeEvent] = deque(maxlen=size)
+        self.seq = 0
+        # Часть id события: номера из разных запусков без журнала не должны совпадать
+        self.epoch = "log" if changes_db is not None else os.urandom(4).hex()
+        self.changed: asyncio.Event | None = None
+        self.subscribers = 0
+        self.resets = 0
+        self.unlogged: list[tuple[ChangeEvent, float]] = []
+        self.flush_task: asyncio.Task | None = None
+
+    def publish(self, topic: str, action: str, **fields):
+        self.seq += 1
+        created_at = time.time()
+        data = dumps({"seq": self.seq, "topic": topic, "action": action, "at": created_at, **fields})
+        event = ChangeEvent(self.seq, topic, data)
+        self.buffer.append(event)
+        if self.changed is not None:
+            self.changed.set()
+            self.changed = None
+        if changes_db is not None:
+            self.unlogged.append((event, created_at))
+            if self.flush_task is None:
+                # Как и пачки WriteCoalescer: запись журнала не числится за запросом, который ее начал
+                self.flush_task = contextvars.Context().run(asyncio.create_task, self.flush_log())
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def parse_id(self, event_id: str | None) -> int | None:
+        # None - начать с текущего места; -1 - id чужой или из будущего, нужен reset
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return -1
+        return int(seq)
+
+    def since(self, seq: int) -> list[ChangeEvent] | None:
+        # События после seq из буфера; None - буфер начинается позже, часть событий вытеснена
+        if seq >= self.seq:
+            return []
+        oldest = self.buffer[0].seq if self.buffer else self.seq + 1
+        if seq + 1 < oldest:
+            return None
+        return list(itertools.islice(self.buffer, seq + 1 - oldest, seq + 1 - oldest + CHANGES_SEND_BATCH))
+
+    async def wait(self, timeout: float) -> bool:
+        if self.changed is None:
+            self.changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def read_log(self, seq: int) -> list[ChangeEvent]:
+        async with changes_db.read_session() as db:
+            rows = await db.execute(
+                select(ChangeLog.seq, ChangeLog.topic, ChangeLog.payload)
+                .where(ChangeLog.seq > seq)
+                .order_by(ChangeLog.seq)
+                .limit(CHANGES_SEND_BATCH)
+            )
+            return [ChangeEvent(seq, topic, payload.encode()) for seq, topic, payload in rows]
+
+    async def flush_log(self):
+        try:
+            await asyncio.sleep(CHANGES_LOG_FLUSH_MS / 1000)
+            while self.unlogged:
+                batch, self.unlogged = self.unlogged, []
+                async with changes_db.write_engine.begin() as conn:
+                    await conn.execute(insert(ChangeLog.__table__), [
+                        {"seq": event.seq, "topic": event.topic, "created_at": created_at, "payload": event.data.decode()}
+                        for event, created_at in batch
+                    ])
+                    if batch[-1][0].seq % 1000 < len(batch):  # примерно раз в тысячу событий
+                        await conn.execute(delete(ChangeLog).where(ChangeLog.seq <= self.seq - CHANGES_LOG_RETENTION))
+        except Exception:
+            # События остаются в буфере в памяти, в журнал эта пачка не попала
+            logger.exception("change log flush failed")
+        finally:
+            self.flush_task = None
+
+    async def start(self, app: FastAPI):
+        if changes_db is None:
+            return
+        await changes_db.start(app)
+        # Продолжаем нумерацию журнала и заполняем буфер его хвостом
+        async with changes_db.read_session() as db:
+            rows = (await db.execute(
+                select(ChangeLog.seq, ChangeLog.topic, ChangeLog.payload)
+                .order_by(ChangeLog.seq.desc())
+                .limit(self.buffer.maxlen)
+            )).all()
+        self.buffer.clear()
+        self.buffer.extend(ChangeEvent(seq, topic, payload.encode()) for seq, topic, payload in reversed(rows))
+        self.seq = rows[0].seq if rows else 0
+
+    async def shutdown(self):
+        if changes_db is None:
+            return
+        if self.flush_task is not None:
+            await self.flush_task
+        await changes_db.dispose()
+
+    def stats(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "oldest": self.buffer[0].seq if self.buffer else None,
+            "buffered": len(self.buffer),
+            "buffer_size": self.buffer.maxlen,
+            "subscribers": self.subscribers,
+            "resets": self.resets,
+            "log": changes_db is not None,
+            "unlogged": len(self.unlogged),
+        }
+
+
+changes = ChangeFeed()
+
+metrics.register_gauge("changes_seq", "sequence number of the last published change", lambda: changes.seq)
+metrics.register_gauge("changes_subscribers", "open change feed connections", lambda: changes.subscribers)
+metrics.register_gauge("changes_resets", "subscribers told to reload after falling behind", lambda: changes.resets)
+
+
+def publish_links(topic: str, action: str, pairs, **fields):
+    # Мелкие пачки связей - списком пар, крупные (bulk, импорт) - только количеством
+    pairs = list(pairs)
+    if not pairs:
+        return
+    if len(pairs) <= CHANGES_MAX_ITEMS:
+        fields["pairs"] = [[parent_id, child_id] for parent_id, child_id in pairs]
+    changes.publish(topic, action, count=len(pairs), **fields)
+
+
+def sse_event(event: ChangeEvent) -> bytes:
+    return b"id: " + changes.event_id(event.seq).encode() + b"\nevent: " + event.topic.encode() + b"\ndata: " + event.data + b"\n\n"
+
+
+def sse_reset(reason: str) -> bytes:
+    data = dumps({"seq": changes.seq, "reason": reason})
+    return b"id: " + changes.event_id(changes.seq).encode() + b"\nevent: reset\ndata: " + data + b"\n\n"
+
+
+async def stream_changes(last_seq: int | None, topics: set[str] | None):
+    changes.subscribers += 1
+    try:
+        yield f"retry: {int(CHANGES_HEARTBEAT * 1000)}\n\n".encode()
+        if last_seq == -1:
+            changes.resets += 1
+            yield sse_reset("unknown event id")
+            last_seq = changes.seq
+        elif last_seq is None:
+            last_seq = changes.seq
+
+        while True:
+            events = changes.since(last_seq)
+            if events is None and changes_db is not None:
+                events = await changes.read_log(last_seq) or None
+            if events is None:
+                # Отстал дальше буфера (и журнала): клиент перечитывает списки, мы идем дальше с текущего
+                changes.resets += 1
+                yield sse_reset("fell behind the change buffer")
+                last_seq = changes.seq
+                continue
+            if events:
+                # Одной записью в сокет: send ждет клиента, и пока он не прочитал - мы не читаем буфер
+                chunk = b"".join(sse_event(event) for event in events if topics is None or event.topic in topics)
+                last_seq = events[-1].seq
+                if chunk:
+                    yield chunk
+                continue
+            if not await changes.wait(CHANGES_HEARTBEAT):
+                yield b": ping\n\n"
+    finally:
+        changes.subscribers -= 1
+
+
+router = APIRouter(prefix="/changes", tags=["Changes"])
+
+
+@router.get("")
+async def change_feed(
+    topics: str | None = Query(None, description="через запятую: tasks,family,users"),
+    last_event_id: str | None = Query(None, description="для EventSource без заголовков"),
+    last_event_id_header: str | None = Header(None, alias="Last-Event-ID"),
+):
+    last_seq = changes.parse_id(last_event_id_header or last_event_id)
+    selected = set(topics.split(",")) if topics else None
+    return StreamingResponse(
+        stream_changes(last_seq, selected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/stats")
+async def change_feed_stats():
+    return changes.stats()
@@ -1,25 +1,133 @@
+import os
+import time
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
-from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from batching import WriteCoalescer
+from metrics import instrument_engine
+from slowlog import watch_engine
+from versions import track_writes
+from schema import Schema, ensure_schema, report_startup
 
 
-DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+# Профиль движка настраивается через переменные окружения
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"  # логирование SQL дорого, по умолчанию выключено
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
 
-engine = create_async_engine(DATABASE_URL, echo=True)  # echo=True для логов SQL
-async_session = async_sessionmaker(bind=engine, expire_on_commit=False)
+# Применяются к каждому новому соединению.
+# WAL: читатели не блокируются писателем. synchronous=NORMAL в режиме WAL безопасен
+# для целостности базы, но не делает fsync на каждый коммит
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),  # первым, чтобы остальные ждали блокировку
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("DB_CACHE_SIZE", "-65536")),  # отрицательное значение - в KiB (64 МБ)
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",  # без этого SQLite не проверяет REFERENCES
+}
+
+
+# Транзакциями управляет SQLAlchemy, а не драйвер. pysqlite в старом режиме сам шлет BEGIN
+# только перед INSERT/UPDATE/DELETE, поэтому SAVEPOINT первым оператором открывал транзакцию
+# сам, и его RELEASE ее коммитил. Отключаем это (isolation_level=None) и шлем BEGIN на каждое
+# начало транзакции. Вид BEGIN можно задать опцией выполнения sqlite_begin, см. schema.py
+def apply_pragmas(engine, read_only: bool = False):
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def begin_transaction(conn):
+        conn.exec_driver_sql(conn.get_execution_options().get("sqlite_begin", "BEGIN"))
+
+
+# Все записи идут через одно соединение (single-writer lane): SQLite все равно
+# допускает одного писателя, а так конкурирующие записи ждут в очереди пула,
+# а не крутятся на busy_timeout. Чтения идут через отдельный пул соединений.
+# Так устроена каждая база приложения (семьи, задачи, for_check): одна конфигурация
+# пулов и прагм, общий старт (проверка схемы) и остановка, см. factory.py
+class Database:
+    def __init__(self, name: str, url: str, schema: Schema | None = None):
+        self.name = name
+        self.url = url
+        self.schema = schema
+        self.write_engine = create_async_engine(
+            url, echo=DB_ECHO, pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+        )
+        self.read_engine = create_async_engine(
+            url, echo=DB_ECHO, pool_size=DB_READ_POOL_SIZE, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+        )
+        apply_pragmas(self.write_engine)
+        apply_pragmas(self.read_engine, read_only=True)
+        instrument_engine(self.write_engine)
+        instrument_engine(self.read_engine)
+        watch_engine(self.write_engine, f"{name}-write")
+        watch_engine(self.read_engine, f"{name}-read")
+        track_writes(self.write_engine)
+
+        self.session = async_sessionmaker(bind=self.write_engine, expire_on_commit=False)
+        self.read_session = async_sessionmaker(bind=self.read_engine, expire_on_commit=False)
+        # Одиночные вставки из create_* копятся и коммитятся пачками (batching.py)
+        self.writer = WriteCoalescer(self.write_engine)
+
+    async def start(self, app: FastAPI):
+        # DDL только если схема в базе отстает от кода
+        if self.schema is None:
+            return
+        started = time.perf_counter()
+        state = await ensure_schema(self.write_engine, self.schema)
+        report_startup(app, self.schema, state, time.perf_counter() - started)
+
+    async def dispose(self):
+        await self.write_engine.dispose()
+        await self.read_engine.dispose()
+
+
+class EngineRegistry:
+    def __init__(self):
+        self.databases: dict[str, Database] = {}
+
+    def register(self, name: str, url: str, schema: Schema | None = None) -> Database:
+        if name in self.databases:
+            raise ValueError(f"Database {name!r} is already registered")
+        self.databases[name] = Database(name, url, schema)
+        return self.databases[name]
+
+    def __getitem__(self, name: str) -> Database:
+        return self.databases[name]
+
+
+engines = EngineRegistry()
 
 Base = declarative_base(cls=AsyncAttrs)
+# Таблицы, индексы и триггеры всех моделей на Base (models.py); версия - schema.py
+family_schema = Schema("family", Base.metadata)
+family_db = engines.register("family", DATABASE_URL, family_schema)
+
+write_engine = family_db.write_engine
+read_engine = family_db.read_engine
+engine = write_engine
+async_session = family_db.session
+read_session = family_db.read_session
+write_coalescer = family_db.writer
 
-async def get_db():
+async def get_write_db():
     async with async_session() as session:
         yield session
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Код выполнения при старте
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    yield
-    # Код выполнения при завершении (опционально)
-    await engine.dispose()
+async def get_read_db():
+    async with read_session() as session:
+        yield session
+
+# Старое имя оставлено для пишущих эндпоинтов
+get_db = get_write_db
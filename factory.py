@@ -0,0 +1,58 @@
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, FastAPI
+
+import admission
+import slowlog
+from changes import changes, router as changes_router
+from db import engines
+from images import thumbnails
+from jobs import jobs
+from metrics import MetricsMiddleware, metrics_endpoint
+from passwords import hasher
+
+
+# Сборка приложения: роутеры + базы из реестра (db.engines) + общий жизненный цикл
+# и admission control для маршрутов, которые ходят в базу (admission.py).
+# Все сервисы (семьи и пользователи, задачи, for_check) можно поднять одним процессом
+# (asyncSQL.app) или по отдельности (main.app, for_check.app) - код один и тот же.
+# На старте каждая база проверяет схему, на остановке - фоновые задачи отменяются,
+# пулы соединений и пулы процессов закрываются
+async def read_root():
+    return {"Hello": "World"}
+
+
+def create_app(
+    routers: list[tuple[APIRouter, str]],
+    databases: tuple[str, ...],
+    import_started: float | None = None,
+) -> FastAPI:
+    # routers - пары (роутер, префикс); databases - имена баз в engines, которые нужны роутерам
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        for name in databases:
+            await engines[name].start(app)
+        await changes.start(app)
+        yield
+        await jobs.shutdown()
+        await changes.shutdown()
+        for name in databases:
+            await engines[name].dispose()
+        hasher.shutdown()
+        thumbnails.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+    # Добавленный последним - внешний: метрики видят и запросы, отклоненные admission control
+    app.add_middleware(admission.AdmissionMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+    app.add_api_route("/", read_root, methods=["GET"])
+    for router, prefix in routers:
+        app.include_router(router, prefix=prefix)
+    app.include_router(slowlog.router)
+    app.include_router(admission.router)
+    app.include_router(changes_router)
+    if import_started is not None:
+        app.state.import_seconds = time.perf_counter() - import_started
+    return app
@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.exceptions import RequestValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select, insert, tuple_, func, literal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from pydantic import TypeAdapter, ValidationError
 from typing import List
 from models import Parent, Child, ParentChildAssociation, ParentResponse, Family, ChildResponse
-from models import LinkResponse
-from db import get_db
+from models import LinkResponse, LinkCreate, LinkStatus, FamilyBulkResult, FamilyBulkResponse, TWO_PARENTS_ERROR
+from models import PersonIdentity, IdentityResponse, DescendantNode, AncestorNode, FamilyUnit, FamilyUnitResponse
+from db import get_db, get_read_db, read_session, write_coalescer
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, ndjson_response
+from cache import cache, invalidate_link
+from serialization import FastJSONResponse, json_rows, response_columns
+from versions import conditional_response
+from jobs import JobStatus
+from purge import start_purge
+from changes import changes, publish_links
 from sqlalchemy.exc import IntegrityError 
 
 router = APIRouter(prefix="/family", tags=["Relations"])
@@ -31,67 +42,200 @@ async def create_family(family: Family, db: AsyncSession = Depends(get_db)):
             db.add(new_association1)
             
     await db.commit()
+    for child in children:
+        invalidate_link(parent1_id, child)
+        if par2:
+            invalidate_link(parent2_id, child)
+    parents = [parent1_id, parent2_id] if par2 else [parent1_id]
+    publish_links("family", "linked", [(parent_id, child) for child in children for parent_id in parents])
     return {"detail": "Family created successfully"}
 
 
+# Массовая загрузка семей. Вместо ORM-объекта на каждую связь пишем пачками
+# многострочных INSERT в одной транзакции, дубли пропускаем через ON CONFLICT.
+# 2 параметра на строку -> держимся ниже старого лимита SQLite в 999 переменных
+BULK_CHUNK_SIZE = 400
+
+families_adapter = TypeAdapter(list[Family])
+
+
+def family_pairs(family: Family) -> list[tuple[int, int]]:
+    parents = [family.parent1]
+    if family.parent2:
+        parents.append(family.parent2)
+    return [(parent_id, child_id) for child_id in family.children or [] for parent_id in parents]
+
+
+async def read_families(request: Request) -> list[Family]:
+    # Принимаем либо JSON-массив, либо NDJSON (одна семья на строку)
+    try:
+        if "ndjson" not in request.headers.get("content-type", ""):
+            return families_adapter.validate_json(await request.body())
+
+        families = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            families.extend(Family.model_validate_json(line) for line in lines if line.strip())
+        if buffer.strip():
+            families.append(Family.model_validate_json(buffer))
+        return families
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+
+def insert_links_stmt(chunk: list[tuple[int, int]]):
+    table = ParentChildAssociation.__table__
+    return (
+        sqlite_insert(table)
+        .values([{"parent_id": parent_id, "child_id": child_id} for parent_id, child_id in chunk])
+        .on_conflict_do_nothing()
+        .returning(table.c.parent_id, table.c.child_id)
+    )
+
+
+async def insert_links(pairs: list[tuple[int, int]], db: AsyncSession) -> tuple[set, set]:
+    # Возвращает (вставленные, отклоненные) пары. Дубли не попадают ни туда, ни туда:
+    # RETURNING не отдает строки, пропущенные через ON CONFLICT
+    created = set()
+    rejected = set()
+    for start in range(0, len(pairs), BULK_CHUNK_SIZE):
+        chunk = pairs[start:start + BULK_CHUNK_SIZE]
+        try:
+            async with db.begin_nested():
+                created.update((await db.execute(insert_links_stmt(chunk))).tuples().all())
+            continue
+        except IntegrityError:
+            pass
+
+        # В пачке есть связь на несуществующего человека или третий родитель:
+        # разбираем ее по одной строке, остальные строки не теряем
+        for pair in chunk:
+            try:
+                async with db.begin_nested():
+                    created.update((await db.execute(insert_links_stmt([pair]))).tuples().all())
+            except IntegrityError:
+                rejected.add(pair)
+    return created, rejected
+
+
+@router.post("/bulk", response_model=FamilyBulkResponse, status_code=status.HTTP_201_CREATED)
+async def create_families_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    families = await read_families(request)
+    family_links = [family_pairs(family) for family in families]
+    # dict.fromkeys убирает повторы внутри запроса, сохраняя порядок
+    pairs = list(dict.fromkeys(pair for links in family_links for pair in links))
+
+    try:
+        created, rejected = await insert_links(pairs, db)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}"
+        )
+
+    for parent_id, child_id in created:
+        invalidate_link(parent_id, child_id)
+    publish_links("family", "linked", sorted(created))
+
+    # Созданную пару засчитываем первой семье, которая ее прислала
+    results = []
+    for family, links in zip(families, family_links):
+        created_count = 0
+        rejected_count = 0
+        for pair in links:
+            if pair in created:
+                created.discard(pair)
+                created_count += 1
+            elif pair in rejected:
+                rejected_count += 1
+        results.append(FamilyBulkResult(
+            parent1=family.parent1,
+            parent2=family.parent2,
+            created=created_count,
+            skipped=len(links) - created_count - rejected_count,
+            rejected=rejected_count
+        ))
+
+    total_created = sum(result.created for result in results)
+    total_rejected = sum(result.rejected for result in results)
+    return FamilyBulkResponse(
+        created=total_created,
+        skipped=sum(len(links) for links in family_links) - total_created - total_rejected,
+        rejected=total_rejected,
+        families=results
+    )
+
+
 #План такой: сначала создаем родителя, потом ребенка, потом связь, потом проверяем, что все работает
 #Как раз потренирую CRUD запросы с асинхронностью.
 
 
 @router.post("/create_parent", response_model=ParentResponse)
-async def create_parent(name: str, db: AsyncSession = Depends(get_db)):
-    parent = Parent(name = name)
-    db.add(parent)
-
-    await db.commit()
-    await db.refresh(parent)
+async def create_parent(name: str):
+    parent = await write_coalescer.insert(Parent.__table__, {"name": name})
+    cache.invalidate(("parent", parent.id))
+    changes.publish("family", "created", entity="parent", id=parent.id)
     return ParentResponse(id=parent.id, name=parent.name)
 
 
 @router.get("/all_parents", response_model=list[ParentResponse])
-async def read_parents(db: AsyncSession = Depends(get_db)):
-    parents = (await db.execute(select(Parent))).scalars().all()
+async def read_parents(
+    request: Request,
+    after_id: int | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    # stream=true отдает всю таблицу (начиная с after_id) в NDJSON без limit
+    stmt = select(*response_columns(Parent, ParentResponse))
+    if stream:
+        return ndjson_response(read_session, keyset_page(stmt, Parent.id, after_id, None))
 
-    return parents
+    async def render():
+        return json_rows(await db.execute(keyset_page(stmt, Parent.id, after_id, limit)))
 
+    return await conditional_response(request, ("parents",), render)
 
-@router.delete("/all_parents")
-async def delete_all_parents(db: AsyncSession = Depends(get_db)):
-    await db.execute(delete(Parent))
-    await db.commit()
-    
-    return {"Success": "All parents deleted"}
+
+@router.delete("/all_parents", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def delete_all_parents(response: Response):
+    # Удаление идет в фоне пачками (purge.py) вместе со связями и person_identity
+    return start_purge("parents", response)
 
 
 @router.post("/create_child", response_model=ChildResponse)
-async def create_child(name : str, db: AsyncSession = Depends(get_db)):
-    child = Child(name=name)
-    db.add(child)
-    
-    await db.commit()
-    await db.refresh(child)
+async def create_child(name : str):
+    child = await write_coalescer.insert(Child.__table__, {"name": name})
+    cache.invalidate(("child", child.id))
+    changes.publish("family", "created", entity="child", id=child.id)
 
-    return child
+    return ChildResponse(id=child.id, name=child.name)
 
 @router.get("/all_children", response_model=list[ChildResponse])
-async def read_children(db: AsyncSession = Depends(get_db)):
-    children = (await db.execute(select(Child))).scalars().all()
+async def read_children(
+    request: Request,
+    after_id: int | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    stmt = select(*response_columns(Child, ChildResponse))
+    if stream:
+        return ndjson_response(read_session, keyset_page(stmt, Child.id, after_id, None))
 
-    return children
+    async def render():
+        return json_rows(await db.execute(keyset_page(stmt, Child.id, after_id, limit)))
 
+    return await conditional_response(request, ("children",), render)
 
-@router.delete("/all_children")
-async def delete_children(db: AsyncSession = Depends(get_db)):
-    try:
-        result = await db.execute(delete(Child))
-        await db.commit()  # Обязательно!
-        return {
-            "deleted_count": result.rowcount,
-            "status": "success"
-        }
-    except Exception as e:
-        await db.rollback()  # Откат при ошибке
-        raise HTTPException(500, detail=str(e))
+
+@router.delete("/all_children", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def delete_children(response: Response):
+    return start_purge("children", response)
 
 
 #максимум 2 родителя на одного ребёнка. Детей у каждого родителя может быть сколько угодно.
@@ -99,6 +243,27 @@ async def delete_children(db: AsyncSession = Depends(get_db)):
 
 #Уточнение. Чтобы не переписывать и не раздувать функцию, если у родителя несколько детей,
 #То этот запрос просто будет выполняться многократно, массивов в ячейке таблицы нужно избегать
+
+#Все правила проверяет база одним INSERT: внешние ключи (foreign_keys=ON), составной
+#первичный ключ и триггер association_two_parents. Здесь только переводим ошибку в HTTP-ответ
+async def link_error(error: IntegrityError, parent_id: int, child_id: int, db: AsyncSession) -> HTTPException:
+    message = str(error.orig)
+    if "UNIQUE" in message:
+        return HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Relationship already exists")
+    if TWO_PARENTS_ERROR in message:
+        return HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Child already has two parents")
+    if "FOREIGN KEY" in message:
+        # SQLite не говорит, какой ключ не сошелся - уточняем только на пути ошибки
+        if not await get_parent_cached(parent_id, db):
+            return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parent not found")
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Child not found")
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Database integrity error")
+
+
+def link_stmt(parent_id: int, child_id: int):
+    return insert(ParentChildAssociation.__table__).values(parent_id=parent_id, child_id=child_id)
+
+
 @router.post(
     "/link/{parent_id}/{child_id}", 
     response_model=LinkResponse,
@@ -110,76 +275,315 @@ async def link_family(
     db: AsyncSession = Depends(get_db)
 ):
     try:
-        # Проверка существования родителя
-        parent = await db.scalar(select(Parent).where(Parent.id == parent_id))
-        if not parent:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Parent not found"
-            )
-
-        # Проверка существования ребенка
-        child = await db.scalar(select(Child).where(Child.id == child_id))
-        if not child:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail="Child not found"
-            )
-
-        # Проверка существующей связи (опционально)
-        existing_link = await db.scalar(
-            select(ParentChildAssociation).where(
-                ParentChildAssociation.parent_id == parent_id,
-                ParentChildAssociation.child_id == child_id
-            )
-        )
-        if existing_link:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Relationship already exists"
-            )
-
-        # Создание связи
-        link = ParentChildAssociation(
-            parent_id=parent_id,
-            child_id=child_id
-        )
-        db.add(link)
+        await db.execute(link_stmt(parent_id, child_id))
         await db.commit()
 
-        return link
-
     except IntegrityError as e:
+        await db.rollback()
+        raise await link_error(e, parent_id, child_id, db)
+
+    except Exception as e:
         await db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Database integrity error"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}"
         )
 
+    invalidate_link(parent_id, child_id)
+    publish_links("family", "linked", [(parent_id, child_id)])
+    return LinkResponse(parent_id=parent_id, child_id=child_id)
+
+
+@router.post("/links", response_model=list[LinkStatus])
+async def link_many(links: list[LinkCreate], db: AsyncSession = Depends(get_db)):
+    # Все пары в одной транзакции, каждая в своем SAVEPOINT: ошибка одной пары
+    # не откатывает остальные, а статус у каждой свой (как у /link/{parent_id}/{child_id})
+    results = []
+    created = []
+    try:
+        for link in links:
+            try:
+                async with db.begin_nested():
+                    await db.execute(link_stmt(link.parent_id, link.child_id))
+                created.append((link.parent_id, link.child_id))
+                code, detail = status.HTTP_201_CREATED, "Created"
+            except IntegrityError as e:
+                error = await link_error(e, link.parent_id, link.child_id, db)
+                code, detail = error.status_code, error.detail
+            results.append(LinkStatus(parent_id=link.parent_id, child_id=link.child_id, status=code, detail=detail))
+        await db.commit()
+
     except Exception as e:
         await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Internal server error: {str(e)}"
         )
+
+    for parent_id, child_id in created:
+        invalidate_link(parent_id, child_id)
+    publish_links("family", "linked", created)
+    return results
     
 
 @router.get("/link/dump", response_model=list[LinkResponse])
-async def all_links(db: AsyncSession = Depends(get_db)):
-    links = (await db.execute(select(ParentChildAssociation))).scalars().all()
-    await db.commit()
+async def all_links(
+    request: Request,
+    after_parent_id: int | None = None,
+    after_child_id: int = 0,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    # У связи составной ключ, поэтому курсор - пара (parent_id, child_id)
+    key = tuple_(ParentChildAssociation.parent_id, ParentChildAssociation.child_id)
+    stmt = select(*response_columns(ParentChildAssociation, LinkResponse)).order_by(
+        ParentChildAssociation.parent_id, ParentChildAssociation.child_id
+    )
+    if after_parent_id is not None:
+        stmt = stmt.where(key > tuple_(after_parent_id, after_child_id))
 
-    return links
+    if stream:
+        return ndjson_response(read_session, stmt)
 
+    async def render():
+        return json_rows(await db.execute(stmt.limit(limit)))
 
-@router.get("/get_children/{parent_id}", response_model=list[ChildResponse])
-async def get_children(parent_id: int, db: AsyncSession = Depends(get_db)):
-    try:
+    return await conditional_response(request, ("association",), render)
+
+
+# Точечные чтения идут через кэш (cache.py). Кэшируем готовые pydantic-модели,
+# а не ORM-объекты, потому что те привязаны к сессии запроса
+async def get_parent_cached(parent_id: int, db: AsyncSession) -> ParentResponse | None:
+    async def load():
         parent = await db.get(Parent, parent_id)
+        return ParentResponse(id=parent.id, name=parent.name) if parent else None
 
-        await db.refresh(parent)
-        return parent.children
+    return await cache.get_or_load(("parent", parent_id), load)
 
-    except Exception as e:
+
+async def get_child_cached(child_id: int, db: AsyncSession) -> ChildResponse | None:
+    async def load():
+        child = await db.get(Child, child_id)
+        return ChildResponse(id=child.id, name=child.name) if child else None
+
+    return await cache.get_or_load(("child", child_id), load)
+
+
+@router.get("/parent/{parent_id}", response_model=ParentResponse)
+async def get_parent(parent_id: int, db: AsyncSession = Depends(get_read_db)):
+    parent = await get_parent_cached(parent_id, db)
+    if not parent:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parent not found")
+    return parent
+
+
+@router.get("/child/{child_id}", response_model=ChildResponse)
+async def get_child(child_id: int, db: AsyncSession = Depends(get_read_db)):
+    child = await get_child_cached(child_id, db)
+    if not child:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Child not found")
+    return child
+
+
+@router.get("/get_children/{parent_id}", response_model=list[ChildResponse])
+async def get_children(parent_id: int, db: AsyncSession = Depends(get_read_db)):
+    if not await get_parent_cached(parent_id, db):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parent not found")
+
+    async def load():
+        rows = await db.execute(
+            select(Child.id, Child.name)
+            .join(ParentChildAssociation, ParentChildAssociation.child_id == Child.id)
+            .where(ParentChildAssociation.parent_id == parent_id)
+            .order_by(Child.id)
+        )
+        return [ChildResponse(id=id, name=name) for id, name in rows]
+
+    return await cache.get_or_load(("children_of", parent_id), load)
+
+
+@router.get("/get_parents/{child_id}", response_model=list[ParentResponse])
+async def get_parents(child_id: int, db: AsyncSession = Depends(get_read_db)):
+    if not await get_child_cached(child_id, db):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Child not found")
+
+    async def load():
+        rows = await db.execute(
+            select(Parent.id, Parent.name)
+            .join(ParentChildAssociation, ParentChildAssociation.parent_id == Parent.id)
+            .where(ParentChildAssociation.child_id == child_id)
+            .order_by(Parent.id)
+        )
+        return [ParentResponse(id=id, name=name) for id, name in rows]
+
+    return await cache.get_or_load(("parents_of", child_id), load)
+
+
+# Семьи и братья/сестры читаются из family_units (models.py) по индексу (parent1_id, parent2_id),
+# без самосоединений association и пересечения списков детей на клиенте
+@router.get("/units", response_model=list[FamilyUnitResponse])
+async def read_family_units(
+    request: Request,
+    after_parent1: int | None = None,
+    after_parent2: int = 0,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Курсор - ключ семьи; limit считает семьи, а не детей
+    key = tuple_(FamilyUnit.parent1_id, FamilyUnit.parent2_id)
+    stmt = (
+        select(FamilyUnit.parent1_id, FamilyUnit.parent2_id, func.group_concat(FamilyUnit.child_id))
+        .group_by(FamilyUnit.parent1_id, FamilyUnit.parent2_id)
+        .order_by(FamilyUnit.parent1_id, FamilyUnit.parent2_id)
+        .limit(limit)
+    )
+    if after_parent1 is not None:
+        stmt = stmt.where(key > tuple_(after_parent1, after_parent2))
+
+    async def render():
+        rows = await db.execute(stmt)
+        return FastJSONResponse([
+            {
+                "parent1": parent1,
+                "parent2": parent2 or None,
+                "children": sorted(int(child_id) for child_id in children.split(",")),
+            }
+            for parent1, parent2, children in rows
+        ])
+
+    # Триггеры пишут в family_units внутри INSERT/DELETE по association - версию поднимает
+    # association; family_units - на случай пересборки таблицы при обновлении схемы
+    return await conditional_response(request, ("association", "family_units"), render)
+
+
+@router.get("/siblings/{child_id}", response_model=list[ChildResponse])
+async def get_siblings(child_id: int, db: AsyncSession = Depends(get_read_db)):
+    # Дети с той же парой родителей (или с тем же единственным родителем), кроме самого ребенка
+    if not await get_child_cached(child_id, db):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Child not found")
+
+    own = FamilyUnit.__table__.alias("own")
+    siblings = FamilyUnit.__table__.alias("siblings")
+    rows = await db.execute(
+        select(Child.id, Child.name)
+        .select_from(own)
+        .join(siblings, (siblings.c.parent1_id == own.c.parent1_id) & (siblings.c.parent2_id == own.c.parent2_id))
+        .join(Child, Child.id == siblings.c.child_id)
+        .where(own.c.child_id == child_id, siblings.c.child_id != child_id)
+        .order_by(Child.id)
+    )
+    return [ChildResponse(id=id, name=name) for id, name in rows]
+
+
+# Обход дерева по поколениям одним запросом WITH RECURSIVE вместо get_children на каждом уровне.
+# Переход между поколениями: ребенок -> (person_identity) -> он же как родитель -> его дети
+MAX_TRAVERSAL_DEPTH = 64
+
+
+@router.post(
+    "/identity/{child_id}/{parent_id}",
+    response_model=IdentityResponse,
+    status_code=status.HTTP_201_CREATED
+)
+async def link_identity(child_id: int, parent_id: int, db: AsyncSession = Depends(get_db)):
+    if not await db.get(Child, child_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Child not found")
+    if not await db.get(Parent, parent_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parent not found")
+
+    try:
+        db.add(PersonIdentity(child_id=child_id, parent_id=parent_id))
+        await db.commit()
+    except IntegrityError:
         await db.rollback()
-    
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Identity already exists"
+        )
+
+    changes.publish("family", "created", entity="identity", child_id=child_id, parent_id=parent_id)
+    return IdentityResponse(child_id=child_id, parent_id=parent_id)
+
+
+def descendants_query(parent_id: int, max_depth: int):
+    links = ParentChildAssociation.__table__
+    identity = PersonIdentity.__table__
+
+    tree = (
+        select(links.c.child_id, literal(1).label("depth"))
+        .where(links.c.parent_id == parent_id)
+        .cte("descendants", recursive=True)
+    )
+    tree = tree.union(
+        select(links.c.child_id, tree.c.depth + 1)
+        .select_from(
+            tree.join(identity, identity.c.child_id == tree.c.child_id)
+            .join(links, links.c.parent_id == identity.c.parent_id)
+        )
+        .where(tree.c.depth < max_depth)
+    )
+
+    # Один и тот же потомок может встретиться на разных уровнях - берем ближайший
+    depth = func.min(tree.c.depth).label("depth")
+    return (
+        select(Child.id, Child.name, depth, identity.c.parent_id)
+        .join(tree, tree.c.child_id == Child.id)
+        .outerjoin(identity, identity.c.child_id == Child.id)
+        .group_by(Child.id)
+        .order_by(depth, Child.id)
+    )
+
+
+def ancestors_query(child_id: int, max_depth: int):
+    links = ParentChildAssociation.__table__
+    identity = PersonIdentity.__table__
+
+    tree = (
+        select(links.c.parent_id, literal(1).label("depth"))
+        .where(links.c.child_id == child_id)
+        .cte("ancestors", recursive=True)
+    )
+    tree = tree.union(
+        select(links.c.parent_id, tree.c.depth + 1)
+        .select_from(
+            tree.join(identity, identity.c.parent_id == tree.c.parent_id)
+            .join(links, links.c.child_id == identity.c.child_id)
+        )
+        .where(tree.c.depth < max_depth)
+    )
+
+    depth = func.min(tree.c.depth).label("depth")
+    return (
+        select(Parent.id, Parent.name, depth, identity.c.child_id)
+        .join(tree, tree.c.parent_id == Parent.id)
+        .outerjoin(identity, identity.c.parent_id == Parent.id)
+        .group_by(Parent.id)
+        .order_by(depth, Parent.id)
+    )
+
+
+@router.get("/descendants/{parent_id}", response_model=list[DescendantNode])
+async def get_descendants(
+    parent_id: int,
+    max_depth: int = Query(MAX_TRAVERSAL_DEPTH, ge=1, le=MAX_TRAVERSAL_DEPTH),
+    db: AsyncSession = Depends(get_read_db)
+):
+    rows = (await db.execute(descendants_query(parent_id, max_depth))).all()
+    return [
+        DescendantNode(id=id, name=name, depth=depth, as_parent_id=as_parent_id)
+        for id, name, depth, as_parent_id in rows
+    ]
+
+
+@router.get("/ancestors/{child_id}", response_model=list[AncestorNode])
+async def get_ancestors(
+    child_id: int,
+    max_depth: int = Query(MAX_TRAVERSAL_DEPTH, ge=1, le=MAX_TRAVERSAL_DEPTH),
+    db: AsyncSession = Depends(get_read_db)
+):
+    rows = (await db.execute(ancestors_query(child_id, max_depth))).all()
+    return [
+        AncestorNode(id=id, name=name, depth=depth, as_child_id=as_child_id)
+        for id, name, depth, as_child_id in rows
+    ]
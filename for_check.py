@@ -1,26 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.orm import declarative_base, sessionmaker, Mapped, mapped_column, Session    
-from fastapi import Depends, FastAPI, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()  # до остальных импортов: время старта пишется в лог (factory.py)
+from sqlalchemy import Column, Integer, String, select, delete, update
+from sqlalchemy.orm import declarative_base, Mapped, mapped_column
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 import uvicorn
-
-
-# Настройка подключения к SQLite (файл mydb.db)
-engine = create_engine("sqlite:///mydatab.db")
+import os
+from passwords import hasher, needs_rehash
+from schema import Schema
+from db import engines
+from factory import create_app
+
+
+# Настройка подключения к SQLite (файл mydatab.db). Движки - в общем реестре db.engines,
+# эндпоинты асинхронные и не занимают потоки threadpool.
+# Старые значения без драйвера (sqlite:///...) переводим на aiosqlite
+CHECK_DATABASE_URL = os.getenv("CHECK_DATABASE_URL", "sqlite+aiosqlite:///mydatab.db")
+if CHECK_DATABASE_URL.startswith("sqlite:///"):
+    CHECK_DATABASE_URL = CHECK_DATABASE_URL.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
 Base = declarative_base()  # ← База для моделей
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Создаём таблицы в БД при старте, а не при импорте - и только если схема отстает (schema.py)
+check_schema = Schema("check", Base.metadata)
+check_db = engines.register("check", CHECK_DATABASE_URL, check_schema)
 
-def get_db():
+async def get_db():
     # Этап 1: Создание сессии (при вызове Depends(get_db))
-    db = SessionLocal()  # ← Сессия открыта
-
-    try:
+    async with check_db.session() as db:  # ← Сессия открыта
         # Этап 2: Передача сессии в эндпоинт
         yield db  # ← Сессия "заморожена" и используется в запросе
+    # Этап 3: Закрытие сессии (после завершения эндпоинта) - выход из async with
 
-    finally:
-        # Этап 3: Закрытие сессии (после завершения эндпоинта)
-        db.close()  # ← Сессия закрыта
+async def get_read_db():
+    async with check_db.read_session() as db:
+        yield db
 
 # Описываем таблицу "users" как класс
 class User(Base):
@@ -28,63 +41,78 @@ class User(Base):
     id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name : Mapped[str]
     email : Mapped[str]
-    password : Mapped[str]
+    password : Mapped[str]  # хэш scrypt, см. passwords.py
 
-# Создаём таблицы в БД
-Base.metadata.create_all(engine)
-
-app = FastAPI()
+router = APIRouter(tags=["Check users"])
 
 # Схема для создания (клиент → сервер)
 class UserCreate(BaseModel):
     name: str
     email: str
-    password: str  # В реальном проекте хэшируйте!
+    password: str  # в базе хранится только хэш
 
 # Схема для ответа (сервер → клиент)
 class UserResponse(BaseModel):
     id: int  # Добавляем id, который вернёт БД
     name: str
     email: str
-        
 
-@app.post("/users", response_model = UserResponse)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = User(name = user.name, email = user.email, password = user.password)
+class LoginRequest(BaseModel):
+    email: str
+    password: str
+        
 
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user) # Refresh the object to get the id
+@router.post("/users", response_model = UserResponse)
+async def create_user(user: UserCreate):
+    password = await hasher.hash(user.password)
+    db_user = await check_db.writer.insert(User.__table__, {"name": user.name, "email": user.email, "password": password})
     return UserResponse(id=db_user.id, name=db_user.name, email=db_user.email)
-    
-@app.get("/")
-def read_root():
-    return {"Hello": "World"}
 
 
-@app.get("/users/all_users", response_model=list[UserResponse])
-def get_all_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+@router.post("/users/login", response_model=UserResponse)
+async def login(credentials: LoginRequest):
+    # Сессия закрывается до проверки пароля: соединение не ждет пул процессов
+    async with check_db.read_session() as db:
+        user = (await db.execute(
+            select(User.id, User.name, User.email, User.password)
+            .where(User.email == credentials.email)
+            .order_by(User.id)
+        )).first()
+    # Без пользователя проверка идет против хэша-заглушки: время ответа не выдает, есть ли email
+    if not await hasher.verify(credentials.password, user.password if user else None):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    if needs_rehash(user.password):
+        new_hash = await hasher.hash(credentials.password)
+        async with check_db.session() as db:
+            await db.execute(update(User).where(User.id == user.id).values(password=new_hash))
+            await db.commit()
+    return UserResponse(id=user.id, name=user.name, email=user.email)
+
+
+@router.get("/users/all_users", response_model=list[UserResponse])
+async def get_all_users(db: AsyncSession = Depends(get_read_db)):
+    users = (await db.execute(select(User.id, User.name, User.email))).all()
 
     if not users:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return users
+    return [UserResponse(id=id, name=name, email=email) for id, name, email in users]
 
-@app.get("/users/{user_id}", response_model=UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).get(user_id)
+@router.get("/users/{user_id}", response_model=UserResponse)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return user
+    return UserResponse(id=user.id, name=user.name, email=user.email)
 
-@app.delete("/users/{user_id}")  # ← Добавлен / перед users
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    deleted_count = db.query(User).filter(User.id == user_id).delete()
-    db.commit()
+@router.delete("/users/{user_id}")  # ← Добавлен / перед users
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(delete(User).where(User.id == user_id))
+    await db.commit()
 
-    if not deleted_count:  # Более питонический вариант проверки
+    if not result.rowcount:  # Более питонический вариант проверки
         raise HTTPException(
             status_code=404,
             detail=f"User with ID {user_id} not found"
@@ -93,23 +121,26 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     return {"detail": f"User {user_id} successfully deleted"}
 
 #обновление данных
-@app.put("/users/{user_id}", response_model=UserResponse)
-def update_user(user_id: int, user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).get(user_id)
-    if not db_user:
+@router.put("/users/{user_id}", response_model=UserResponse)
+async def update_user(user_id: int, user: UserCreate, db: AsyncSession = Depends(get_db)):
+    # Хэш считаем до записи, чтобы не держать соединение писателя
+    password = await hasher.hash(user.password)
+    result = await db.execute(
+        update(User).where(User.id == user_id).values(name=user.name, email=user.email, password=password)
+    )
+    await db.commit()
+    if not result.rowcount:
         raise HTTPException(status_code=404, detail="User not found")
-    db_user.name = user.name
-    db_user.email = user.email
-    db_user.password = user.password
-    db.commit()
-    db.refresh(db_user)
-    return UserResponse(id=db_user.id, name=db_user.name, email=db_user.email)
+    return UserResponse(id=user_id, name=user.name, email=user.email)
 
 
 # @app.delete("/users/{user_id}")
 # def del_user(user_id: int, )
 
 
+# Только эти эндпоинты, отдельным процессом; в asyncSQL.app они смонтированы под /check
+app = create_app([(router, "")], databases=("check",), import_started=IMPORT_STARTED)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
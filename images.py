@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Path as PathParam, Request
+from fastapi.responses import FileResponse, Response
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import select, update
+from starlette.concurrency import run_in_threadpool
+
+from db import async_session, read_session
+from models import User
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow картинки принимаются и отдаются, но без миниатюр
+    Image = None
+
+
+# Картинки пользователей. Загрузка читается потоком (multipart разбирается по кускам)
+# и сразу пишется во временный файл рядом с хранилищем, попутно считается sha256.
+# Файл хранится под своим хэшем (content-addressed): одинаковые картинки лежат один раз,
+# а URL по хэшу никогда не меняет содержимое, поэтому его можно кэшировать навсегда
+IMAGE_STORAGE_DIR = Path(os.getenv("IMAGE_STORAGE_DIR", "images"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_THUMB_SIZES = tuple(int(size) for size in os.getenv("IMAGE_THUMB_SIZES", "64,256").split(","))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+DIGEST_PATTERN = "^[0-9a-f]{64}$"
+
+# Тип определяем по первым байтам файла, а не по заголовку от клиента
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+SNIFF_BYTES = 12
+
+logger = logging.getLogger("images")
+
+
+def sniff(head: bytes) -> str | None:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def blob_dir(digest: str) -> Path:
+    return IMAGE_STORAGE_DIR / digest[:2]
+
+
+def original_path(digest: str) -> Path | None:
+    for extension in MEDIA_TYPES:
+        path = blob_dir(digest) / f"{digest}.{extension}"
+        if path.exists():
+            return path
+    return None
+
+
+def thumbnail_path(digest: str, size: int) -> Path:
+    return blob_dir(digest) / f"{digest}.{size}.png"
+
+
+def make_thumbnails(source: str, targets: list[tuple[int, str]]):
+    # Выполняется в процессе пула. Пишем во временный файл и переименовываем:
+    # читатель никогда не увидит недописанную миниатюру
+    with Image.open(source) as image:
+        image.load()
+        for size, target in targets:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                thumbnail.save(f, format="PNG", optimize=True)
+            os.replace(tmp, target)
+
+
+class ThumbnailPool:
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+        # Одну и ту же картинку могут загрузить одновременно - миниатюры делаем один раз
+        self.in_progress: dict[str, asyncio.Future] = {}
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                method = "forkserver" if sys.platform != "win32" else "spawn"
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            return self.executor
+
+    async def ensure(self, digest: str, source: Path) -> list[int]:
+        if Image is None:
+            return []
+        missing = [(size, str(thumbnail_path(digest, size))) for size in IMAGE_THUMB_SIZES
+                   if not thumbnail_path(digest, size).exists()]
+        if missing:
+            if digest not in self.in_progress:
+                self.in_progress[digest] = asyncio.get_running_loop().run_in_executor(
+                    self.get_executor(), make_thumbnails, str(source), missing
+                )
+            try:
+                await self.in_progress[digest]
+            except Exception:
+                # Заголовок файла похож на картинку, но Pillow ее не разобрал - отдаем без миниатюр
+                logger.warning("thumbnails failed for %s", digest, exc_info=True)
+                return []
+            finally:
+                self.in_progress.pop(digest, None)
+        return list(IMAGE_THUMB_SIZES)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+thumbnails = ThumbnailPool()
+
+
+class ImageUpload:
+    # Приемник для MultipartParser: берет первую часть с именем file, остальные пропускает
+    def __init__(self, field: str = "file"):
+        self.field = field
+        self.header_field = b""
+        self.header_value = b""
+        self.part_name = None
+        self.receiving = False
+        self.done = False
+        self.chunks: list[bytes] = []
+        self.size = 0
+
+    def on_part_begin(self):
+        self.part_name = None
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        if self.header_field.lower() == b"content-disposition":
+            _, options = parse_options_header(self.header_value)
+            self.part_name = options.get(b"name", b"").decode("latin-1")
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        self.receiving = not self.done and self.part_name == self.field
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.receiving:
+            self.size += end - start
+            if self.size > IMAGE_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+            self.chunks.append(data[start:end])
+
+    def on_part_end(self):
+        if self.receiving:
+            self.receiving = False
+            self.done = True
+
+    def callbacks(self) -> dict:
+        return {
+            name: getattr(self, name)
+            for name in (
+                "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+                "on_headers_finished", "on_part_data", "on_part_end",
+            )
+        }
+
+
+async def receive_image(request: Request) -> tuple[str, str, int, bool]:
+    # Возвращает (sha256, расширение, размер, была ли такая картинка уже в хранилище)
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data with a 'file' field")
+
+    IMAGE_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+    sink = ImageUpload()
+    parser = MultipartParser(boundary, sink.callbacks())
+    digest = hashlib.sha256()
+    head = b""
+    fd, tmp = tempfile.mkstemp(dir=IMAGE_STORAGE_DIR, suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if not sink.chunks:
+                    continue
+                data = b"".join(sink.chunks)
+                sink.chunks.clear()
+                if len(head) < SNIFF_BYTES:
+                    head += data[:SNIFF_BYTES - len(head)]
+                digest.update(data)
+                await run_in_threadpool(f.write, data)
+            parser.finalize()
+
+        if not sink.done:
+            raise HTTPException(status_code=422, detail="Multipart body has no 'file' field")
+        extension = sniff(head)
+        if extension is None:
+            raise HTTPException(status_code=415, detail="Only PNG, JPEG, GIF and WebP images are accepted")
+
+        hexdigest = digest.hexdigest()
+        existing = original_path(hexdigest)
+        if existing is not None:
+            return hexdigest, existing.suffix[1:], sink.size, True
+        blob_dir(hexdigest).mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, blob_dir(hexdigest) / f"{hexdigest}.{extension}")
+        return hexdigest, extension, sink.size, False
+    except MultipartParseError as e:
+        # Битое тело (чужая граница, оборванные заголовки части) - ошибка клиента, а не 500
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def image_response(request: Request, path: Path, digest: str, media_type: str, cache_control: str) -> Response:
+    # Файл отдает FileResponse: Range/If-Range, а на серверах с расширением
+    # http.response.pathsend - без копирования через Python
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+router = APIRouter(prefix="/users", tags=["Users"])
+
+
+@router.post("/users/{user_id}/image")
+async def upload_image(user_id: int, request: Request):
+    # Пользователя проверяем до чтения тела, чтобы не принимать файл впустую
+    async with read_session() as db:
+        if await db.scalar(select(User.id).where(User.id == user_id)) is None:
+            raise HTTPException(status_code=404, detail="User not found")
+
+    digest, extension, size, deduplicated = await receive_image(request)
+    sizes = await thumbnails.ensure(digest, original_path(digest))
+
+    async with async_session() as db:
+        await db.execute(update(User).where(User.id == user_id).values(image=digest))
+        await db.commit()
+
+    return {
+        "user_id": user_id,
+        "image": digest,
+        "media_type": MEDIA_TYPES[extension],
+        "size": size,
+        "deduplicated": deduplicated,
+        "url": f"/users/images/{digest}",
+        "thumbnails": {size: f"/users/images/{digest}/thumb/{size}" for size in sizes},
+    }
+
+
+@router.get("/users/{user_id}/image")
+async def get_user_image(user_id: int, request: Request):
+    async with read_session() as db:
+        digest = await db.scalar(select(User.image).where(User.id == user_id))
+    path = original_path(digest) if digest and len(digest) == 64 else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="User has no uploaded image")
+    # Картинка пользователя может смениться, поэтому здесь только ревалидация по ETag
+    return image_response(request, path, digest, MEDIA_TYPES[path.suffix[1:]], "no-cache")
+
+
+@router.get("/images/{digest}")
+async def get_image(request: Request, digest: str = PathParam(pattern=DIGEST_PATTERN)):
+    path = original_path(digest)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image_response(request, path, digest, MEDIA_TYPES[path.suffix[1:]], IMMUTABLE_CACHE)
+
+
+@router.get("/images/{digest}/thumb/{size}")
+async def get_thumbnail(size: int, request: Request, digest: str = PathParam(pattern=DIGEST_PATTERN)):
+    if size not in IMAGE_THUMB_SIZES:
+        raise HTTPException(status_code=404, detail=f"Thumbnail sizes: {list(IMAGE_THUMB_SIZES)}")
+    source = original_path(digest)
+    if source is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if Image is None:
+        raise HTTPException(status_code=404, detail="Thumbnails are not available (Pillow is not installed)")
+    if not await thumbnails.ensure(digest, source):
+        raise HTTPException(status_code=404, detail="Thumbnails are not available (the image could not be decoded)")
+    return image_response(request, thumbnail_path(digest, size), f"{digest}.{size}", "image/png", IMMUTABLE_CACHE)
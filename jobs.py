@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from metrics import metrics
+
+
+# Фоновые задачи (массовые удаления и т.п.). Эндпоинт отвечает 202 сразу, задача идет
+# в event loop процесса, прогресс виден на GET /jobs/{id}. Состояние живет в памяти:
+# после рестарта незавершенная задача не продолжается, ее нужно запустить заново.
+# Храним последние JOBS_HISTORY_SIZE задач, старые завершенные вытесняются
+JOBS_HISTORY_SIZE = int(os.getenv("JOBS_HISTORY_SIZE", "100"))
+
+logger = logging.getLogger("jobs")
+
+
+class JobStatus(BaseModel):
+    id: int
+    kind: str
+    target: str
+    status: Literal["running", "done", "failed", "cancelled"]
+    total: int
+    done: int
+    batches: int
+    error: str | None = None
+    started_at: float
+    finished_at: float | None = None
+
+
+class Job:
+    def __init__(self, id: int, kind: str, target: str):
+        self.id = id
+        self.kind = kind
+        self.target = target
+        self.status = "running"
+        self.total = 0
+        self.done = 0
+        self.batches = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.task: asyncio.Task | None = None
+
+    def snapshot(self) -> JobStatus:
+        return JobStatus(
+            id=self.id, kind=self.kind, target=self.target, status=self.status, total=self.total,
+            done=self.done, batches=self.batches, error=self.error,
+            started_at=self.started_at, finished_at=self.finished_at,
+        )
+
+
+class JobRegistry:
+    def __init__(self, history: int = JOBS_HISTORY_SIZE):
+        self.history = history
+        self.ids = itertools.count(1)
+        self.jobs: OrderedDict[int, Job] = OrderedDict()
+
+    def active(self, kind: str, target: str) -> Job | None:
+        for job in self.jobs.values():
+            if job.kind == kind and job.target == target and job.status == "running":
+                return job
+        return None
+
+    def start(self, kind: str, target: str, work) -> Job:
+        # work(job) - корутина, которая сама двигает job.done/job.total.
+        # Повторный запуск той же задачи, пока идет первая, возвращает первую
+        job = self.active(kind, target)
+        if job is not None:
+            return job
+        job = Job(next(self.ids), kind, target)
+        self.jobs[job.id] = job
+        self.trim()
+        job.task = asyncio.create_task(self.run(job, work))
+        return job
+
+    async def run(self, job: Job, work):
+        try:
+            await work(job)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception("job %s %s/%s failed", job.id, job.kind, job.target)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def trim(self):
+        finished = [id for id, job in self.jobs.items() if job.status != "running"]
+        for id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[id]
+
+    def get(self, job_id: int) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def running(self) -> int:
+        return sum(job.status == "running" for job in self.jobs.values())
+
+    async def shutdown(self):
+        # Незакоммиченная пачка откатывается, закоммиченные остаются удаленными
+        tasks = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+jobs = JobRegistry()
+metrics.register_gauge("background_jobs_running", "Background jobs currently running", jobs.running)
+
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+@router.get("", response_model=list[JobStatus])
+async def list_jobs():
+    return [job.snapshot() for job in reversed(jobs.jobs.values())]
+
+
+@router.get("/{job_id}", response_model=JobStatus)
+async def get_job(job_id: int):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.snapshot()
@@ -1,17 +1,26 @@
+import time
+IMPORT_STARTED = time.perf_counter()  # до остальных импортов: время старта пишется в лог (schema.py)
 from pydantic import BaseModel, Field, field_validator
-from fastapi import FastAPI, HTTPException
-from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Request
+from datetime import datetime, date
 from typing import Optional
 import sqlite3
-from sqlalchemy import create_engine, text
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
-from sqlalchemy import select, insert
+import sys
+from sqlalchemy import text, Date, Index, and_, or_
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import select, insert, func
 import asyncio
+import os
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ndjson_response
+from serialization import FastJSONResponse, json_rows, response_columns, rows_to_dicts
+from versions import conditional_response
+from schema import Schema, ensure_schema
+from db import engines
+from changes import changes
+from factory import create_app
 
-# Асинхронный движок для SQLite (aiosqlite)
-engine = create_async_engine("sqlite+aiosqlite:///mydatabase.db")
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# База задач (aiosqlite), движки создаются в реестре db.engines
+TASKS_DATABASE_URL = os.getenv("TASKS_DATABASE_URL", "sqlite+aiosqlite:///mydatabase.db")
 
 
 class Base(DeclarativeBase):
@@ -33,12 +42,214 @@ class Task(Base):
     priority: Mapped[Optional[int]]
     deadline: Mapped[Optional[str]]
     percent: Mapped[int] = mapped_column(default=0)
+    # deadline хранится как в API (YYYY-DD-MM) и так не сортируется,
+    # поэтому рядом лежит нормализованная дата для фильтров и сортировки
+    deadline_on: Mapped[Optional[date]] = mapped_column(Date)
 
-engine = create_engine("sqlite:///tasks.db")  # Файл tasks.db появится автоматически
+    __table_args__ = (
+        Index("ix_tasks_status_priority", "status", "priority"),
+        Index("ix_tasks_category_status", "category", "status"),
+        Index("ix_tasks_status_deadline_on", "status", "deadline_on"),
+        Index("ix_tasks_deadline_on", "deadline_on"),
+        Index("ix_tasks_priority", "priority"),
+        Index("ix_tasks_percent", "percent"),
+    )
 
-app = FastAPI()
 
-# Создание таблиц при старте
+# Сводка для дашборда: число задач и сумма percent по (category, status).
+# Поддерживается триггерами на tasks, поэтому чтение стоит O(категорий), а не O(задач)
+class TaskStat(Base):
+    __tablename__ = "task_stats"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    category: Mapped[Optional[str]]
+    status: Mapped[bool]
+    count: Mapped[int] = mapped_column(default=0)
+    percent_sum: Mapped[int] = mapped_column(default=0)
+
+    __table_args__ = (
+        Index("ix_task_stats_category_status", "category", "status"),
+    )
+
+DEADLINE_FORMAT = "%Y-%d-%m"
+
+
+def parse_deadline(value: Optional[str]) -> Optional[date]:
+    if value is None:
+        return None
+    return datetime.strptime(value, DEADLINE_FORMAT).date()
+
+
+def migrate_tasks(conn):
+    # Старые базы: добавляем deadline_on, заполняем его из deadline и досоздаем индексы
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(tasks)")}
+    if "deadline_on" not in columns:
+        conn.exec_driver_sql("ALTER TABLE tasks ADD COLUMN deadline_on DATE")
+
+    rows = conn.exec_driver_sql(
+        "SELECT id, deadline FROM tasks WHERE deadline IS NOT NULL AND deadline_on IS NULL"
+    ).all()
+    updates = []
+    for task_id, deadline in rows:
+        try:
+            updates.append((parse_deadline(deadline).isoformat(), task_id))
+        except ValueError:
+            pass  # невалидные старые значения оставляем без нормализованной даты
+    if updates:
+        conn.exec_driver_sql("UPDATE tasks SET deadline_on = ? WHERE id = ?", updates)
+
+    for index in Task.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+    ensure_tasks_fts(conn)
+    ensure_task_stats(conn)
+
+
+# Полнотекстовый поиск: FTS5-индекс над title и description. Индекс хранит только
+# токены (content='tasks'), сами строки берутся из tasks по rowid = id.
+# Триггеры держат индекс в актуальном состоянии при любой записи в tasks
+TASKS_FTS_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+        title, description, content='tasks', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF id, title, description ON tasks BEGIN
+        INSERT INTO tasks_fts(tasks_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO tasks_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+)
+
+
+def ensure_tasks_fts(conn):
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks_fts'"
+    ).first()
+    for ddl in TASKS_FTS_DDL:
+        conn.exec_driver_sql(ddl)
+    # Индекс появился в базе, где задачи уже есть - заполняем его из tasks
+    if not exists:
+        rebuild_tasks_fts(conn)
+
+
+def rebuild_tasks_fts(conn):
+    conn.exec_driver_sql("INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')")
+
+
+# Прибавить/вычесть строку задачи из сводки. category сравнивается через IS,
+# чтобы задачи без категории тоже попадали в одну строку сводки
+def task_stats_change(row: str, sign: str) -> str:
+    match = f"category IS {row}.category AND status = {row}.status"
+    sql = f"""
+        UPDATE task_stats SET count = count {sign} 1, percent_sum = percent_sum {sign} {row}.percent
+        WHERE {match};
+    """
+    if sign == "+":
+        sql += f"""
+        INSERT INTO task_stats (category, status, count, percent_sum)
+        SELECT {row}.category, {row}.status, 1, {row}.percent
+        WHERE NOT EXISTS (SELECT 1 FROM task_stats WHERE {match});
+        """
+    else:
+        sql += f"""
+        DELETE FROM task_stats WHERE {match} AND count <= 0;
+        """
+    return sql
+
+
+TASK_STATS_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS task_stats_insert AFTER INSERT ON tasks BEGIN
+        {task_stats_change("new", "+")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS task_stats_delete AFTER DELETE ON tasks BEGIN
+        {task_stats_change("old", "-")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS task_stats_update AFTER UPDATE OF category, status, percent ON tasks BEGIN
+        {task_stats_change("old", "-")}
+        {task_stats_change("new", "+")}
+    END
+    """,
+)
+
+TASK_STATS_FROM_TASKS = """
+    SELECT category, status, COUNT(*) AS count, SUM(percent) AS percent_sum
+    FROM tasks GROUP BY category, status
+"""
+
+
+def ensure_task_stats(conn):
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'task_stats_insert'"
+    ).first()
+    for ddl in TASK_STATS_TRIGGERS:
+        conn.exec_driver_sql(ddl)
+    # Без триггеров сводка не велась - считаем ее заново
+    if not exists:
+        recompute_task_stats(conn)
+
+
+def recompute_task_stats(conn):
+    conn.exec_driver_sql("DELETE FROM task_stats")
+    conn.exec_driver_sql(
+        f"INSERT INTO task_stats (category, status, count, percent_sum) {TASK_STATS_FROM_TASKS}"
+    )
+
+
+def check_task_stats(conn) -> list[dict]:
+    # Расхождения между сводкой и пересчетом с нуля по tasks
+    stored = {
+        (row.category, bool(row.status)): (row.count, row.percent_sum)
+        for row in conn.exec_driver_sql("SELECT category, status, count, percent_sum FROM task_stats")
+    }
+    actual = {
+        (row.category, bool(row.status)): (row.count, row.percent_sum)
+        for row in conn.exec_driver_sql(TASK_STATS_FROM_TASKS)
+    }
+    mismatches = []
+    for category, status in sorted(stored.keys() | actual.keys(), key=lambda key: (key[0] is not None, key[0] or "", key[1])):
+        expected = actual.get((category, status), (0, 0))
+        found = stored.get((category, status), (0, 0))
+        if expected != found:
+            mismatches.append({
+                "category": category,
+                "status": status,
+                "stored": {"count": found[0], "percent_sum": found[1]},
+                "actual": {"count": expected[0], "percent_sum": expected[1]},
+            })
+    return mismatches
+
+
+# Схема задач: таблицы моделей + миграция старых баз, FTS и триггеры сводки (migrate_tasks).
+# Выполняется только если схема в базе отстает от кода, см. schema.py
+tasks_schema = Schema("tasks", Base.metadata, ensure=migrate_tasks, ddl=TASKS_FTS_DDL + TASK_STATS_TRIGGERS)
+tasks_db = engines.register("tasks", TASKS_DATABASE_URL, tasks_schema)
+engine = tasks_db.write_engine
+async_session = tasks_db.session
+read_session = tasks_db.read_session
+# Вставки задач коммитятся пачками (group commit), см. batching.py
+task_writer = tasks_db.writer
+
+router = APIRouter(tags=["Tasks"])
 
 
 # Pydantic модели
@@ -57,50 +268,271 @@ class TaskSchema(BaseModel):
         if value is None:
             return value
         try:
-            datetime.strptime(value, "%Y-%d-%m")
+            datetime.strptime(value, DEADLINE_FORMAT)
             return value
         except ValueError:
             raise ValueError("Invalid date format. Use YYYY-DD-MM")
 
 # Эндпоинты
-@app.post("/tasks", response_model=TaskSchema)
+@router.post("/tasks", response_model=TaskSchema)
 async def create_task(task: TaskSchema):
-    async with async_session() as session:
-        try:
-            result = await session.execute(
-                insert(Task).values(**task.model_dump())
-            )
-            await session.commit()
-            return task
-        except Exception as e:
-            await session.rollback()
-            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        values = task.model_dump()
+        values["deadline_on"] = parse_deadline(task.deadline)
+        await task_writer.insert(Task.__table__, values)
+        changes.publish("tasks", "created", id=task.id)
+        return task
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Сортировка: имя поля, "-" в начале - по убыванию. Внутри одинаковых значений - по id
+SORT_COLUMNS = {"id": Task.id, "priority": Task.priority, "deadline": Task.deadline_on, "percent": Task.percent}
+SORT_PATTERN = "^-?(" + "|".join(SORT_COLUMNS) + ")$"
+
 
-@app.get("/tasks", response_model=list[TaskSchema])
-async def get_tasks():
-    async with async_session() as session:
-        result = await session.execute(select(Task))
-        tasks = result.scalars().all()
-        return tasks
+def parse_deadline_param(name: str, value: Optional[str]) -> Optional[date]:
+    try:
+        return parse_deadline(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid {name} format. Use YYYY-DD-MM")
 
-@app.get("/tasks/alltasks")
+
+def sorted_page(stmt, sort: str, after_id: Optional[int], after_value: Optional[str]):
+    # Курсорная пагинация по паре (значение сортировки, id). Клиент берет оба значения
+    # из последней строки страницы. NULL в SQLite меньше любого значения, поэтому
+    # при сортировке по возрастанию такие строки идут первыми, по убыванию - последними
+    descending = sort.startswith("-")
+    name = sort.lstrip("-")
+    column = SORT_COLUMNS[name]
+
+    if column is Task.id:
+        if after_id is not None:
+            stmt = stmt.where(Task.id < after_id if descending else Task.id > after_id)
+        return stmt.order_by(Task.id.desc() if descending else Task.id)
+
+    if after_id is not None:
+        if after_value is None:
+            if descending:
+                stmt = stmt.where(column.is_(None), Task.id < after_id)
+            else:
+                stmt = stmt.where(or_(and_(column.is_(None), Task.id > after_id), column.is_not(None)))
+        else:
+            if name == "deadline":
+                value = parse_deadline_param("after_value", after_value)
+            else:
+                try:
+                    value = int(after_value)
+                except ValueError:
+                    raise HTTPException(status_code=422, detail="after_value must be an integer")
+            if descending:
+                stmt = stmt.where(or_(column < value, and_(column == value, Task.id < after_id), column.is_(None)))
+            else:
+                stmt = stmt.where(or_(column > value, and_(column == value, Task.id > after_id)))
+
+    if descending:
+        return stmt.order_by(column.desc(), Task.id.desc())
+    return stmt.order_by(column, Task.id)
+
+
+@router.get("/tasks", response_model=list[TaskSchema])
+async def get_tasks(
+    request: Request,
+    status: Optional[bool] = None,
+    category: Optional[str] = None,
+    priority_min: Optional[int] = None,
+    priority_max: Optional[int] = None,
+    deadline_from: Optional[str] = Query(None, description="YYYY-DD-MM, включительно"),
+    deadline_to: Optional[str] = Query(None, description="YYYY-DD-MM, включительно"),
+    percent_min: Optional[int] = Query(None, ge=0, le=100),
+    percent_max: Optional[int] = Query(None, ge=0, le=100),
+    sort: str = Query("id", pattern=SORT_PATTERN),
+    after_id: Optional[int] = None,
+    after_value: Optional[str] = Query(None, description="значение поля сортировки у последней строки"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
+):
+    stmt = select(*response_columns(Task, TaskSchema))
+    if status is not None:
+        stmt = stmt.where(Task.status == status)
+    if category is not None:
+        stmt = stmt.where(Task.category == category)
+    if priority_min is not None:
+        stmt = stmt.where(Task.priority >= priority_min)
+    if priority_max is not None:
+        stmt = stmt.where(Task.priority <= priority_max)
+    if deadline_from is not None:
+        stmt = stmt.where(Task.deadline_on >= parse_deadline_param("deadline_from", deadline_from))
+    if deadline_to is not None:
+        stmt = stmt.where(Task.deadline_on <= parse_deadline_param("deadline_to", deadline_to))
+    if percent_min is not None:
+        stmt = stmt.where(Task.percent >= percent_min)
+    if percent_max is not None:
+        stmt = stmt.where(Task.percent <= percent_max)
+    stmt = sorted_page(stmt, sort, after_id, after_value)
+
+    if stream:
+        return ndjson_response(read_session, stmt)
+
+    # Строки из базы не валидируются повторно: validate_deadline (strptime) уже отработал при записи
+    async def render():
+        async with read_session() as session:
+            return json_rows(await session.execute(stmt.limit(limit)))
+
+    return await conditional_response(request, ("tasks",), render)
+
+class TaskSearchHit(BaseModel):
+    id: int
+    category: Optional[str] = None
+    status: bool
+    title: str
+    snippet: str
+    rank: float
+
+
+# Вес совпадения в заголовке выше, чем в описании
+SEARCH_WEIGHTS = (10.0, 1.0)
+SEARCH_SNIPPET_TOKENS = 16
+
+
+def fts_query(q: str, prefix: bool) -> str:
+    # Каждое слово берем в кавычки: пользовательский ввод не должен разбираться
+    # как синтаксис FTS5 (AND/OR/NEAR, двоеточия, звездочки). Слова объединяются по AND
+    terms = ['"' + term.replace('"', '""') + '"' for term in q.split()]
+    if prefix and terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+@router.get("/tasks/search", response_model=list[TaskSearchHit])
+async def search_tasks(
+    q: str = Query(min_length=1, max_length=200),
+    prefix: bool = Query(False, description="последнее слово ищется как префикс"),
+    status: Optional[bool] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0)
+):
+    match = fts_query(q, prefix)
+    if not match:
+        raise HTTPException(status_code=422, detail="Empty search query")
+
+    sql = f"""
+        SELECT t.id, t.category, t.status,
+               highlight(tasks_fts, 0, '<b>', '</b>') AS title,
+               snippet(tasks_fts, 1, '<b>', '</b>', '...', {SEARCH_SNIPPET_TOKENS}) AS snippet,
+               bm25(tasks_fts, {SEARCH_WEIGHTS[0]}, {SEARCH_WEIGHTS[1]}) AS rank
+        FROM tasks_fts JOIN tasks AS t ON t.id = tasks_fts.rowid
+        WHERE tasks_fts MATCH :match {"AND t.status = :status" if status is not None else ""}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    """
+    params = {"match": match, "limit": limit, "offset": offset}
+    if status is not None:
+        params["status"] = status
+
+    async with read_session() as session:
+        result = await session.execute(text(sql), params)
+        return result.mappings().all()
+
+class CategoryStats(BaseModel):
+    category: Optional[str] = None
+    total: int
+    done: int
+    open: int
+    avg_percent: Optional[float] = None
+    overdue: int
+
+
+class TaskStatsResponse(BaseModel):
+    total: int
+    done: int
+    open: int
+    avg_percent: Optional[float] = None
+    overdue: int
+    as_of: date
+    categories: list[CategoryStats]
+
+
+@router.get("/tasks/stats", response_model=TaskStatsResponse)
+async def get_task_stats():
+    today = date.today()
+    async with read_session() as session:
+        summary = (await session.execute(
+            select(TaskStat.category, TaskStat.status, TaskStat.count, TaskStat.percent_sum)
+        )).all()
+        # Просрочка зависит от текущей даты, поэтому в сводке ее нет: считаем по индексу
+        # (status, deadline_on) - читаются только просроченные открытые задачи
+        overdue = dict((await session.execute(
+            select(Task.category, func.count())
+            .where(Task.status == False, Task.deadline_on < today)  # noqa: E712
+            .group_by(Task.category)
+        )).all())
+
+    categories = {}
+    for category, status, count, percent_sum in summary:
+        item = categories.setdefault(category, {"total": 0, "done": 0, "percent_sum": 0})
+        item["total"] += count
+        item["percent_sum"] += percent_sum
+        if status:
+            item["done"] += count
+
+    result = []
+    for category, item in sorted(categories.items(), key=lambda pair: (pair[0] is not None, pair[0] or "")):
+        result.append(CategoryStats(
+            category=category,
+            total=item["total"],
+            done=item["done"],
+            open=item["total"] - item["done"],
+            avg_percent=item["percent_sum"] / item["total"] if item["total"] else None,
+            overdue=overdue.get(category, 0),
+        ))
+
+    total = sum(item.total for item in result)
+    done = sum(item.done for item in result)
+    percent_sum = sum(item["percent_sum"] for item in categories.values())
+    return TaskStatsResponse(
+        total=total,
+        done=done,
+        open=total - done,
+        avg_percent=percent_sum / total if total else None,
+        overdue=sum(overdue.values()),
+        as_of=today,
+        categories=result,
+    )
+
+
+@router.get("/tasks/stats/check")
+async def check_stats():
+    # Только проверка: GET ничего не меняет, пересчет - POST /tasks/stats/recompute
+    async with tasks_db.read_engine.connect() as conn:
+        mismatches = await conn.run_sync(check_task_stats)
+    return {"consistent": not mismatches, "mismatches": mismatches}
+
+
+@router.post("/tasks/stats/recompute")
+async def recompute_stats():
+    async with engine.begin() as conn:
+        mismatches = await conn.run_sync(check_task_stats)
+        if mismatches:
+            await conn.run_sync(recompute_task_stats)
+    return {"consistent": True, "repaired": bool(mismatches), "mismatches": mismatches}
+
+@router.get("/tasks/alltasks")
 async def get_all_tasks():
-    async with async_session() as session:
+    async with read_session() as session:
         try:
             # Выполняем обычный SQL-запрос
-            result = await session.execute(text("SELECT * FROM tasks"))
-
-            # Получаем все записи
-            tasks = result.mappings().all()
+            result = await session.execute(text(
+                "SELECT id, category, title, description, status, priority, deadline, percent FROM tasks"
+            ))
 
-            # Преобразуем в список словарей
-            tasks_list = [dict(task) for task in tasks]
+            # Получаем все записи кортежами и сразу кодируем ответ (см. serialization.py)
+            tasks_list = rows_to_dicts(list(result.keys()), result.all())
 
-            return {
+            return FastJSONResponse({
                 "status": "success",
                 "data": tasks_list,
                 "count": len(tasks_list)
-            }
+            })
 
         except Exception as e:
             raise HTTPException(
@@ -109,14 +541,35 @@ async def get_all_tasks():
             )
     
 
-@app.get("/")
-async def read_root():
-    return {"Hello": "World"}
+# Пересборка нужна, если tasks меняли в обход триггеров (например, импорт с отключенными триггерами)
+async def run_maintenance(task):
+    await ensure_schema(engine, tasks_schema)
+    async with engine.begin() as conn:
+        await conn.run_sync(task)
+    await tasks_db.dispose()
+
+
+MAINTENANCE_COMMANDS = {
+    "rebuild-fts": rebuild_tasks_fts,
+    "recompute-stats": recompute_task_stats,
+}
+
+
+# Только задачи, отдельным процессом; все сервисы вместе - asyncSQL.app
+app = create_app([(router, "")], databases=("tasks",), import_started=IMPORT_STARTED)
+
 
 # Для запуска
+# python main.py              - сервер
+# python main.py rebuild-fts      - пересобрать поисковый индекс задач
+# python main.py recompute-stats  - пересчитать сводку task_stats с нуля
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if len(sys.argv) == 2 and sys.argv[1] in MAINTENANCE_COMMANDS:
+        asyncio.run(run_maintenance(MAINTENANCE_COMMANDS[sys.argv[1]]))
+        print(f"{sys.argv[1]}: done")
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)
 
 
 
@@ -0,0 +1,199 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Callable
+
+from sqlalchemy import event
+from starlette.responses import Response
+
+
+# Метрики в формате Prometheus: задержки по маршрутам, статусы, запросы в работе,
+# а также число SQL-запросов и время в базе на каждый HTTP-запрос.
+# Заголовки X-DB-Queries / X-DB-Time-Ms включаются через METRICS_DB_HEADERS=1
+METRICS_DB_HEADERS = os.getenv("METRICS_DB_HEADERS", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Заполняются middleware на время HTTP-запроса и читаются из событий SQLAlchemy
+request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+current_scope: ContextVar[dict | None] = ContextVar("current_scope", default=None)
+
+
+def route_template(scope: dict | None) -> str | None:
+    # Метка - шаблон пути (/family/parent/{parent_id}), а не сам путь, иначе меток будет без счета.
+    # Роутер Starlette кладет найденный маршрут в тот же scope, поэтому шаблон доступен
+    # и во время обработки запроса, и после нее
+    if scope is None:
+        return None
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "unmatched"
+    # Префикс из include_router(..., prefix=...) в route.path не входит (for_check под /check),
+    # FastAPI хранит его в контексте подключенного роутера
+    included = (scope.get("fastapi") or {}).get("included_router")
+    prefix = getattr(getattr(included, "include_context", None), "prefix", "")
+    return prefix + path
+
+
+def get_current_route() -> str | None:
+    return route_template(current_scope.get())
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+def format_labels(labels: dict) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class Metrics:
+    def __init__(self):
+        self.in_flight = 0
+        self.latency: dict[tuple, Histogram] = {}
+        self.query_counts: dict[tuple, Histogram] = {}
+        self.requests: dict[tuple, int] = {}
+        self.db_time: dict[tuple, float] = {}
+        # Дополнительные показатели других модулей: имя -> (описание, функция без аргументов)
+        self.gauges: dict[str, tuple[str, Callable]] = {}
+
+    def register_gauge(self, name: str, help_text: str, read):
+        self.gauges[name] = (help_text, read)
+
+    def observe(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+        key = (method, route)
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.query_counts[key] = Histogram(QUERY_COUNT_BUCKETS)
+            self.db_time[key] = 0.0
+        self.latency[key].observe(elapsed)
+        self.query_counts[key].observe(stats.queries)
+        self.db_time[key] += stats.db_time
+        status_key = (method, route, status)
+        self.requests[status_key] = self.requests.get(status_key, 0) + 1
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being served",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Finished requests by route and status",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f"http_requests_total{{{format_labels({'method': method, 'route': route, 'status': status})}}} {count}")
+
+        self.render_histograms(
+            lines, "http_request_duration_seconds", "Request latency by route", self.latency
+        )
+        self.render_histograms(
+            lines, "db_queries_per_request", "SQL statements executed per request", self.query_counts
+        )
+
+        lines.append("# HELP db_time_seconds_total Time spent in SQL statements by route")
+        lines.append("# TYPE db_time_seconds_total counter")
+        for (method, route), seconds in sorted(self.db_time.items()):
+            lines.append(f"db_time_seconds_total{{{format_labels({'method': method, 'route': route})}}} {seconds:.6f}")
+
+        for name, (help_text, read) in sorted(self.gauges.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def render_histograms(lines: list, name: str, help_text: str, histograms: dict):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (method, route), histogram in sorted(histograms.items()):
+            labels = format_labels({"method": method, "route": route})
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.total}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.total}")
+
+
+metrics = Metrics()
+
+
+def instrument_engine(engine):
+    # Считаем запросы и время в базе для текущего HTTP-запроса (если он есть)
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += time.perf_counter() - context._metrics_started
+
+
+class MetricsMiddleware:
+    def __init__(self, app, db_headers: bool = METRICS_DB_HEADERS):
+        self.app = app
+        self.db_headers = db_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        stats_token = request_stats.set(stats)
+        scope_token = current_scope.set(scope)
+        status_code = 500
+        started = time.perf_counter()
+        metrics.in_flight += 1
+
+        async def send_with_stats(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.db_headers:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-queries", str(stats.queries).encode()))
+                    headers.append((b"x-db-time-ms", f"{stats.db_time * 1000:.3f}".encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            metrics.in_flight -= 1
+            metrics.observe(scope["method"], route_template(scope), status_code, time.perf_counter() - started, stats)
+            request_stats.reset(stats_token)
+            current_scope.reset(scope_token)
+
+
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
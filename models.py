@@ -1,5 +1,5 @@
 from db import Base
-from sqlalchemy import String, Integer, ForeignKey, Table
+from sqlalchemy import DDL, String, Integer, ForeignKey, Index, Table, event
 from sqlalchemy.orm import Mapped, mapped_column, relationship 
 from pydantic import BaseModel
 
@@ -8,8 +8,8 @@ class User(Base):
   __tablename__ = "users"
   id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
   name: Mapped[str] = mapped_column(String(100))
-  email: Mapped[str] = mapped_column(String(100))
-  password: Mapped[str] = mapped_column(String(50))
+  email: Mapped[str] = mapped_column(String(100), index=True)
+  password: Mapped[str] = mapped_column(String(255))  # хэш scrypt, см. passwords.py
   image: Mapped[str] = mapped_column(String(150))
 
 class UserCreate(BaseModel):
@@ -23,6 +23,10 @@ class UserResponse(BaseModel):
   name: str
   email: str
 
+class LoginRequest(BaseModel):
+  email: str
+  password: str
+
 class ParentResponse(BaseModel):
   id: int
   name: str
@@ -40,6 +44,50 @@ class LinkResponse(BaseModel):
   parent_id: int
   child_id: int
 
+class LinkCreate(BaseModel):
+  parent_id: int
+  child_id: int
+
+class LinkStatus(BaseModel):
+  parent_id: int
+  child_id: int
+  status: int
+  detail: str
+
+class IdentityResponse(BaseModel):
+  child_id: int
+  parent_id: int
+
+class DescendantNode(BaseModel):
+  id: int
+  name: str
+  depth: int
+  as_parent_id: int | None
+
+class AncestorNode(BaseModel):
+  id: int
+  name: str
+  depth: int
+  as_child_id: int | None
+
+class FamilyUnitResponse(BaseModel):
+  parent1: int
+  parent2: int | None
+  children: list[int]
+
+class FamilyBulkResult(BaseModel):
+  parent1: int
+  parent2: int | None
+  created: int
+  skipped: int
+  rejected: int = 0
+
+class FamilyBulkResponse(BaseModel):
+  created: int
+  skipped: int
+  rejected: int = 0
+  families: list[FamilyBulkResult]
+
 # association_table = Table(
 #     "association",
 #     Base.metadata,
@@ -51,11 +99,84 @@ class ParentChildAssociation(Base):
   __tablename__ = "association"
 
   parent_id: Mapped[int] = mapped_column(ForeignKey("parents.id"), primary_key=True)
-  child_id: Mapped[int] = mapped_column(ForeignKey("children.id"), primary_key=True)
+  child_id: Mapped[int] = mapped_column(ForeignKey("children.id"), primary_key=True, index=True)
 
   class Config:
     from_attributes = True
 
+# Правило "не больше двух родителей у ребенка" проверяет сама база.
+# Триггер пересоздается при каждом обновлении схемы - чтобы и старые базы получили новое условие.
+# BEFORE INSERT срабатывает раньше проверки внешних ключей, поэтому несуществующего родителя
+# пропускаем: пусть INSERT упадет на FOREIGN KEY и ответ будет 404, а не 409
+TWO_PARENTS_ERROR = "child already has two parents"
+event.listen(Base.metadata, "after_create", DDL("DROP TRIGGER IF EXISTS association_two_parents"))
+event.listen(Base.metadata, "after_create", DDL(f"""
+CREATE TRIGGER association_two_parents
+BEFORE INSERT ON association
+WHEN EXISTS (SELECT 1 FROM parents WHERE id = NEW.parent_id)
+AND NOT EXISTS (
+    SELECT 1 FROM association WHERE parent_id = NEW.parent_id AND child_id = NEW.child_id
+) AND (SELECT COUNT(*) FROM association WHERE child_id = NEW.child_id) >= 2
+BEGIN
+    SELECT RAISE(ABORT, '{TWO_PARENTS_ERROR}');
+END
+"""))
+
+# Семья как единица: пара родителей и их общие дети. У ребенка не больше двух родителей,
+# поэтому он входит ровно в одну семью - строка на ребенка, ключ семьи (parent1_id, parent2_id),
+# parent1_id < parent2_id, 0 - второго родителя нет. Таблицу ведут триггеры на association,
+# так что ее видят все пути записи: create_family, link_family, /bulk, импорт и удаления
+class FamilyUnit(Base):
+  __tablename__ = "family_units"
+  __table_args__ = (Index("ix_family_units_pair", "parent1_id", "parent2_id", "child_id"),)
+
+  child_id: Mapped[int] = mapped_column(ForeignKey("children.id"), primary_key=True)
+  parent1_id: Mapped[int] = mapped_column(Integer)
+  parent2_id: Mapped[int] = mapped_column(Integer)
+
+# Семьи детей по их строкам в association; у ребенка без связей семьи нет
+def family_units_from_links(where: str = "") -> str:
+  return f"""
+    INSERT INTO family_units (child_id, parent1_id, parent2_id)
+    SELECT child_id, MIN(parent_id), CASE WHEN COUNT(*) > 1 THEN MAX(parent_id) ELSE 0 END
+    FROM association {where} GROUP BY child_id;
+  """
+
+for row, event_name in (("NEW", "INSERT"), ("OLD", "DELETE")):
+  event.listen(Base.metadata, "after_create", DDL(f"""
+CREATE TRIGGER IF NOT EXISTS family_units_{event_name.lower()}
+AFTER {event_name} ON association
+BEGIN
+    DELETE FROM family_units WHERE child_id = {row}.child_id;
+    {family_units_from_links(f"WHERE child_id = {row}.child_id")}
+END
+"""))
+# При обновлении схемы (в том числе когда таблица только появилась) пересобираем ее по association
+event.listen(Base.metadata, "after_create", DDL("DELETE FROM family_units"))
+event.listen(Base.metadata, "after_create", DDL(family_units_from_links()))
+
+# Счетчики изменений для снимка графа в памяти (analytics.py). Новые связи снимок дочитывает
+# по rowid association; удаление или изменение связи и любое изменение person_identity
+# поднимают счетчик, и тогда снимок пересобирается с нуля
+class GraphEpoch(Base):
+  __tablename__ = "graph_epochs"
+
+  name: Mapped[str] = mapped_column(String(50), primary_key=True)
+  value: Mapped[int] = mapped_column(Integer, default=0)
+
+event.listen(Base.metadata, "after_create", DDL(
+  "INSERT OR IGNORE INTO graph_epochs (name, value) VALUES ('association', 0), ('person_identity', 0)"
+))
+for table, events in (("association", ("DELETE", "UPDATE")), ("person_identity", ("INSERT", "DELETE", "UPDATE"))):
+  for event_name in events:
+    event.listen(Base.metadata, "after_create", DDL(f"""
+CREATE TRIGGER IF NOT EXISTS graph_epoch_{table}_{event_name.lower()}
+AFTER {event_name} ON {table}
+BEGIN
+    UPDATE graph_epochs SET value = value + 1 WHERE name = '{table}';
+END
+"""))
+
 class Parent(Base):
   __tablename__ = "parents"
 
@@ -82,4 +203,47 @@ class Child(Base):
       viewonly=False
   )
 
+# Один и тот же человек может быть ребенком (children) и позже родителем (parents).
+# Эта таблица связывает его две записи, чтобы можно было идти по поколениям
+class PersonIdentity(Base):
+  __tablename__ = "person_identity"
 
+  child_id: Mapped[int] = mapped_column(ForeignKey("children.id"), primary_key=True)
+  parent_id: Mapped[int] = mapped_column(ForeignKey("parents.id"), unique=True)
+
+# Импорт из внешних файлов (transfer.py). import_jobs - контрольная точка: сколько строк
+# файла уже закоммичено, пишется в той же транзакции, что и сами строки.
+# import_id_map - какой id получила запись с внешним id в рамках импорта (job)
+class ImportJob(Base):
+  __tablename__ = "import_jobs"
+
+  job: Mapped[str] = mapped_column(String(100), primary_key=True)
+  kind: Mapped[str] = mapped_column(String(20), primary_key=True)
+  rows_done: Mapped[int] = mapped_column(Integer, default=0)
+  created: Mapped[int] = mapped_column(Integer, default=0)
+  duplicates: Mapped[int] = mapped_column(Integer, default=0)
+  rejected: Mapped[int] = mapped_column(Integer, default=0)
+  finished: Mapped[bool] = mapped_column(default=False)
+
+class ImportIdMap(Base):
+  __tablename__ = "import_id_map"
+
+  job: Mapped[str] = mapped_column(String(100), primary_key=True)
+  kind: Mapped[str] = mapped_column(String(20), primary_key=True)
+  external_id: Mapped[str] = mapped_column(String(100), primary_key=True)
+  id: Mapped[int] = mapped_column(Integer)
+
+class ImportRowError(BaseModel):
+  line: int
+  error: str
+
+class ImportResult(BaseModel):
+  job: str
+  kind: str
+  rows_read: int
+  resumed_from: int
+  created: int
+  duplicates: int
+  rejected: int
+  finished: bool
+  errors: list[ImportRowError]
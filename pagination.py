@@ -0,0 +1,32 @@
+from fastapi.responses import StreamingResponse
+
+from serialization import dumps, rows_to_dicts
+
+
+# Общие настройки для всех списочных эндпоинтов
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def keyset_page(stmt, key_column, after_id: int | None, limit: int | None):
+    # Курсорная пагинация: WHERE id > :after_id ORDER BY id LIMIT :limit
+    # В отличие от OFFSET, стоимость не растет с номером страницы - идем по индексу PK
+    if after_id is not None:
+        stmt = stmt.where(key_column > after_id)
+    return stmt.order_by(key_column).limit(limit)
+
+
+def ndjson_response(session_factory, stmt, batch_size: int = STREAM_BATCH_SIZE):
+    # Отдаем таблицу построчно (NDJSON), читая ее пачками по batch_size.
+    # stmt выбирает колонки, а не ORM-объекты: строки сразу кодируются в JSON (см. serialization.py).
+    # Сессия открывается внутри генератора, потому что тело ответа
+    # отправляется уже после выхода из эндпоинта и его зависимостей
+    async def rows():
+        async with session_factory() as session:
+            result = await session.stream(stmt.execution_options(yield_per=batch_size))
+            keys = list(result.keys())
+            async for batch in result.partitions():
+                yield b"".join(dumps(row) + b"\n" for row in rows_to_dicts(keys, batch))
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
@@ -0,0 +1,129 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException
+
+from metrics import metrics
+
+
+# Пароли хэшируются scrypt (memory-hard). Один хэш - десятки миллисекунд CPU и ~16 МБ памяти,
+# поэтому считаем его в пуле процессов: event loop в это время обслуживает остальные запросы.
+# PASSWORD_HASH_WORKERS=0 - считать прямо в вызывающем потоке (только для тестов и сравнения).
+# Если в очереди больше PASSWORD_HASH_MAX_PENDING задач, новые получают 503 - шторм логинов
+# не должен копить бесконечную очередь
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "256"))
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+PREFIX = "scrypt"
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # maxmem с запасом: по умолчанию OpenSSL ограничивает 32 МБ, а 128 * n * r может быть больше
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES, maxmem=256 * n * r + 1024 * 1024
+    )
+
+
+# Формат хранения: scrypt$n$r$p$соль$хэш - параметры лежат рядом с хэшем,
+# поэтому стоимость можно менять, не ломая уже сохраненные пароли
+def hash_password_sync(password: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    salt = os.urandom(SALT_BYTES)
+    return f"{PREFIX}${n}${r}${p}${b64(salt)}${b64(scrypt(password, salt, n, r, p))}"
+
+
+def verify_password_sync(password: str, stored: str) -> bool:
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != PREFIX:
+        # Старые записи хранят пароль как есть
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    _, n, r, p, salt, expected = parts
+    actual = scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    return hmac.compare_digest(actual, base64.b64decode(expected))
+
+
+# Хэш-заглушка для входа с неизвестным email: проверка против нее стоит столько же scrypt,
+# сколько проверка настоящего пароля, и по времени ответа не видно, есть ли такой email
+DUMMY_HASH = f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${b64(bytes(SALT_BYTES))}${b64(bytes(HASH_BYTES))}"
+
+
+def needs_rehash(stored: str) -> bool:
+    # Пароль открытым текстом или с устаревшими параметрами - перехэшируем при успешном входе
+    return not stored.startswith(f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = None
+        # pending меняют и event loop, и потоки синхронных эндпоинтов
+        self.lock = threading.Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        # Пул создается при первом хэше. forkserver, а не fork: процесс с event loop
+        # и потоками aiosqlite небезопасно форкать
+        with self.lock:
+            if self.executor is None:
+                method = "forkserver" if sys.platform != "win32" else "spawn"
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            return self.executor
+
+    def reserve(self):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise HTTPException(
+                    status_code=503, detail="Password hashing is overloaded", headers={"Retry-After": "1"}
+                )
+            self.pending += 1
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        self.reserve()
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            return await asyncio.get_running_loop().run_in_executor(self.get_executor(), fn, *args)
+        finally:
+            self.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password_sync, password)
+
+    async def verify(self, password: str, stored: str | None) -> bool:
+        # stored=None - пользователя нет: считаем scrypt впустую и отказываем
+        if stored is None:
+            await self.run(verify_password_sync, password, DUMMY_HASH)
+            return False
+        return await self.run(verify_password_sync, password, stored)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+hasher = PasswordHasher()
+metrics.register_gauge(
+    "password_hash_queue_depth", "Password hash/verify jobs waiting or running in the pool", lambda: hasher.pending
+)
+metrics.register_gauge("password_hash_workers", "Size of the password hashing process pool", lambda: hasher.workers)
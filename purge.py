@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+from fastapi import Response, status
+from sqlalchemy import delete, func, literal_column, select
+
+from cache import cache
+from changes import changes
+from db import async_session
+from jobs import Job, JobStatus, jobs
+from models import Child, ImportIdMap, ImportJob, Parent, ParentChildAssociation, PersonIdentity, User
+
+
+# Массовое удаление пачками вместо одного DELETE по всей таблице. Каждая пачка -
+# своя короткая транзакция на соединении писателя; между пачками соединение
+# возвращается в пул, и ждущие записи успевают пройти. Удаляются строки, которые
+# были в таблице на момент запуска (id <= max(id)): новые вставки не продлевают
+# удаление до бесконечности. 500 id в IN держит нас ниже лимита SQLite в 999 переменных
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+PURGE_BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE_MS", "5")) / 1000
+
+
+class PurgePlan:
+    def __init__(self, model, topic: str, dependents=(), cache_kinds=(), import_kinds=()):
+        self.model = model
+        self.topic = topic  # тема событий в ленте изменений (changes.py)
+        # Столбцы строк, ссылающихся на удаляемые: удаляются в той же пачке
+        self.dependents = dependents
+        self.cache_kinds = cache_kinds
+        # Импорты (transfer.py) с картой внешних id на удаленные строки сбрасываются:
+        # SQLite может выдать те же id новым строкам, и старая карта указала бы на чужие записи
+        self.import_kinds = import_kinds
+
+
+PURGE_PLANS = {
+    "parents": PurgePlan(
+        Parent,
+        "family",
+        dependents=(ParentChildAssociation.parent_id, PersonIdentity.parent_id),
+        cache_kinds=("parent", "children_of", "parents_of"),
+        import_kinds=("parents", "links"),
+    ),
+    "children": PurgePlan(
+        Child,
+        "family",
+        dependents=(ParentChildAssociation.child_id, PersonIdentity.child_id),
+        cache_kinds=("child", "children_of", "parents_of"),
+        import_kinds=("children", "links"),
+    ),
+    "users": PurgePlan(User, "users", cache_kinds=("user",)),
+}
+
+
+async def delete_batch(plan: PurgePlan, after_id: int, max_id: int) -> list[int]:
+    id_column = plan.model.id
+    async with async_session() as db:
+        ids = (await db.scalars(
+            select(id_column).where(id_column > after_id, id_column <= max_id).order_by(id_column).limit(PURGE_BATCH_SIZE)
+        )).all()
+        if ids:
+            for column in plan.dependents:
+                await db.execute(delete(column.table).where(column.in_(ids)))
+            await db.execute(delete(plan.model).where(id_column.in_(ids)))
+            await db.commit()
+    return ids
+
+
+async def delete_import_state(kinds: tuple[str, ...]):
+    # Карта id может быть большой - тоже пачками, по rowid
+    rowid = literal_column("rowid")
+    while True:
+        async with async_session() as db:
+            batch = select(rowid).select_from(ImportIdMap).where(ImportIdMap.kind.in_(kinds)).limit(PURGE_BATCH_SIZE)
+            result = await db.execute(delete(ImportIdMap).where(rowid.in_(batch)))
+            if result.rowcount < PURGE_BATCH_SIZE:
+                await db.execute(delete(ImportJob).where(ImportJob.kind.in_(kinds)))
+            await db.commit()
+        if result.rowcount < PURGE_BATCH_SIZE:
+            return
+        await asyncio.sleep(PURGE_BATCH_PAUSE)
+
+
+async def run_purge(plan: PurgePlan, job: Job):
+    async with async_session() as db:
+        max_id, job.total = (await db.execute(select(func.max(plan.model.id), func.count()).select_from(plan.model))).one()
+    max_id = max_id or 0
+
+    after_id = 0
+    while True:
+        ids = await delete_batch(plan, after_id, max_id)
+        if not ids:
+            break
+        after_id = ids[-1]
+        job.done += len(ids)
+        job.batches += 1
+        # Сбрасываем кэш после каждой пачки, а не в конце: удаленное уже не должно читаться
+        cache.invalidate_kind(*plan.cache_kinds)
+        changes.publish(plan.topic, "deleted", entity=plan.model.__tablename__, count=len(ids), job=job.id)
+        await asyncio.sleep(PURGE_BATCH_PAUSE)
+
+    if plan.import_kinds:
+        await delete_import_state(plan.import_kinds)
+    cache.invalidate_kind(*plan.cache_kinds)
+    changes.publish(plan.topic, "purged", entity=plan.model.__tablename__, count=job.done, job=job.id)
+
+
+def start_purge(target: str, response: Response) -> JobStatus:
+    plan = PURGE_PLANS[target]
+    job = jobs.start("purge", target, lambda job: run_purge(plan, job))
+    response.status_code = status.HTTP_202_ACCEPTED
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return job.snapshot()
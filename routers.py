@@ -1,31 +1,84 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-from models import User, UserCreate, UserResponse
-from db import get_db
+from sqlalchemy import select, update
+from models import User, UserCreate, UserResponse, LoginRequest
+from db import async_session, get_read_db, read_session, write_coalescer
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, ndjson_response
+from cache import cache
+from serialization import json_rows, response_columns
+from passwords import hasher, needs_rehash
+from versions import conditional_response
+from jobs import JobStatus
+from purge import start_purge
+from changes import changes
 
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
 @router.post("/users", response_model=UserResponse)
-async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
-    db_user = User(**user.model_dump())
-    db.add(db_user)
-    await db.commit()
-    print("id = ",db_user.id)
-    await db.refresh(db_user)
-    print("id = ",db_user.id)
+async def create_user(user: UserCreate):
+    values = user.model_dump()
+    values["password"] = await hasher.hash(user.password)
+    db_user = await write_coalescer.insert(User.__table__, values)
+    cache.invalidate(("user", db_user.id))
+    changes.publish("users", "created", id=db_user.id)
   
     return UserResponse(id=db_user.id, name=db_user.name, email=db_user.email)
 
+@router.post("/login", response_model=UserResponse)
+async def login(credentials: LoginRequest):
+    # Сессия закрывается до хэширования: иначе шторм логинов держит все соединения
+    # пула чтения, пока ждет очередь пула процессов, и встают остальные эндпоинты
+    async with read_session() as db:
+        user = (await db.execute(
+            select(User.id, User.name, User.email, User.password)
+            .where(User.email == credentials.email).order_by(User.id).limit(1)
+        )).first()
+    # Неизвестный email и неверный пароль неразличимы для клиента - в том числе по времени:
+    # без пользователя пароль проверяется против хэша-заглушки той же стоимости
+    if not await hasher.verify(credentials.password, user.password if user else None):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    if needs_rehash(user.password):
+        new_hash = await hasher.hash(credentials.password)
+        async with async_session() as write_db:
+            await write_db.execute(update(User).where(User.id == user.id).values(password=new_hash))
+            await write_db.commit()
+
+    return UserResponse(id=user.id, name=user.name, email=user.email)
+
+
 @router.get("/users/all_users", response_model=list[UserResponse])
-async def get_all_users(db: AsyncSession = Depends(get_db)):
-    users = (await db.execute(select(User))).scalars().all()
-    return users
+async def get_all_users(
+    request: Request,
+    after_id: int | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Только колонки ответа: пароль из базы даже не читается
+    stmt = select(*response_columns(User, UserResponse))
+    if stream:
+        return ndjson_response(read_session, keyset_page(stmt, User.id, after_id, None))
+
+    async def render():
+        return json_rows(await db.execute(keyset_page(stmt, User.id, after_id, limit)))
+
+    return await conditional_response(request, ("users",), render)
+
+
+@router.delete("/users/all_users", response_model=JobStatus, status_code=202)
+async def delete_all_users(response: Response):
+    return start_purge("users", response)
+
 
+@router.get("/users/{user_id}", response_model=UserResponse)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    async def load():
+        user = await db.get(User, user_id)
+        return UserResponse(id=user.id, name=user.name, email=user.email) if user else None
 
-@router.delete("/users/all_users")
-async def delete_all_users(db: AsyncSession = Depends(get_db)):
-    await db.execute(delete(User))
-    await db.commit()
-    return {"detail": "All users successfully deleted"}
+    user = await cache.get_or_load(("user", user_id), load)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import logging
+import os
+import time
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+
+# Версия схемы вместо create_all на каждом старте. В базе лежит таблица schema_version:
+# отпечаток схемы (хэш DDL всех таблиц, индексов и триггеров из кода) и номер последней
+# примененной миграции. На старте сравниваем их с кодом одним SELECT; если совпали -
+# никакого DDL и отражения схемы. Если нет - один процесс берет блокировку записи
+# (BEGIN IMMEDIATE), остальные воркеры ждут ее и потом видят уже обновленную версию.
+# Миграции - функции (sync Connection) -> None, выполняются по порядку, каждая один раз
+SCHEMA_LOCK_TIMEOUT = float(os.getenv("SCHEMA_LOCK_TIMEOUT", "60"))
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    applied_at REAL NOT NULL
+)
+"""
+
+# Логгер uvicorn: строка о времени старта окажется рядом с "Application startup complete"
+logger = logging.getLogger("uvicorn.error")
+
+
+class Schema:
+    def __init__(self, name: str, metadata, ensure=None, ddl=(), migrations=()):
+        self.name = name
+        self.metadata = metadata
+        # ensure(conn) - идемпотентная досоздача того, что не описано моделями
+        # (FTS, триггеры); выполняется при любом изменении отпечатка
+        self.ensure = ensure
+        self.ddl = ddl
+        self.migrations = migrations
+
+    @functools.cached_property
+    def fingerprint(self) -> str:
+        # Лениво: к первому старту все модули с моделями уже импортированы
+        return schema_fingerprint(self.metadata, self.ddl)
+
+    @property
+    def version(self) -> int:
+        return len(self.migrations)
+
+
+def schema_fingerprint(metadata, ddl=()) -> str:
+    dialect = sqlite.dialect()
+    statements = []
+    for table in metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)))
+        statements.extend(
+            str(CreateIndex(index).compile(dialect=dialect)) for index in sorted(table.indexes, key=lambda i: i.name)
+        )
+    # DDL, навешанный на metadata через event.listen(..., "after_create", DDL(...))
+    statements.extend(getattr(listener, "statement", "") for listener in metadata.dispatch.after_create)
+    statements.extend(ddl)
+    digest = hashlib.sha256()
+    for statement in statements:
+        digest.update(" ".join(statement.split()).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def stored_version(conn, name: str) -> tuple[int, str | None]:
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).first()
+    if exists is None:
+        return 0, None
+    row = conn.exec_driver_sql("SELECT version, fingerprint FROM schema_version WHERE name = ?", (name,)).first()
+    return (row[0], row[1]) if row else (0, None)
+
+
+def lock_for_migration(conn):
+    # BEGIN IMMEDIATE сразу берет блокировку записи. Сам BEGIN шлет обработчик события begin
+    # движка (db.apply_pragmas), здесь только выбираем его вид. busy_timeout у соединения
+    # может быть короче миграции в другом процессе, поэтому повторяем до SCHEMA_LOCK_TIMEOUT
+    conn.execution_options(sqlite_begin="BEGIN IMMEDIATE")
+    deadline = time.monotonic() + SCHEMA_LOCK_TIMEOUT
+    while True:
+        try:
+            conn.begin()
+            return
+        except OperationalError as e:
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+            conn.rollback()
+            time.sleep(0.1)
+
+
+def upgrade_schema(conn, schema: Schema) -> str:
+    # conn - синхронное соединение (для async-движка - через run_sync).
+    # Возвращает "current", если ничего делать не пришлось, иначе "migrated"
+    version, fingerprint = stored_version(conn, schema.name)
+    conn.commit()
+    if version == schema.version and fingerprint == schema.fingerprint:
+        return "current"
+
+    lock_for_migration(conn)
+    try:
+        # Пока ждали блокировку, схему мог обновить другой воркер
+        version, fingerprint = stored_version(conn, schema.name)
+        if version == schema.version and fingerprint == schema.fingerprint:
+            conn.commit()
+            return "current"
+        if version > schema.version:
+            raise RuntimeError(
+                f"Database schema {schema.name!r} is at version {version}, newer than this code ({schema.version})"
+            )
+
+        conn.exec_driver_sql(SCHEMA_VERSION_DDL)
+        schema.metadata.create_all(conn)
+        if schema.ensure is not None:
+            schema.ensure(conn)
+        for migration in schema.migrations[version:]:
+            migration(conn)
+        # create_all пропускает существующие таблицы вместе с их индексами: индексы,
+        # добавленные в модели позже, на старых базах досоздаем отдельно. После ensure
+        # и миграций - индекс может ссылаться на столбец, который добавляет миграция
+        for table in schema.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.exec_driver_sql(
+            "INSERT OR REPLACE INTO schema_version (name, version, fingerprint, applied_at) VALUES (?, ?, ?, ?)",
+            (schema.name, schema.version, schema.fingerprint, time.time()),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return "migrated"
+
+
+async def ensure_schema(engine, schema: Schema) -> str:
+    async with engine.connect() as conn:
+        return await conn.run_sync(upgrade_schema, schema)
+
+
+def report_startup(app, schema: Schema, state: str, schema_seconds: float):
+    # import_seconds кладет модуль приложения: время от начала его импорта до готового app
+    import_seconds = getattr(app.state, "import_seconds", None)
+    imported = f"import {import_seconds * 1000:.0f} ms, " if import_seconds is not None else ""
+    logger.info(
+        "Startup: %sschema %r %s (v%d) in %.1f ms",
+        imported, schema.name, state, schema.version, schema_seconds * 1000,
+    )
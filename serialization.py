@@ -0,0 +1,37 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # без orjson работает стандартный json, только медленнее
+    orjson = None
+
+
+# Быстрый путь для списков: выбираем из базы только колонки ответа (кортежи, без ORM-объектов),
+# не прогоняем каждую строку через pydantic - данные из базы уже прошли валидацию при записи -
+# и кодируем JSON через orjson. Эндпоинт возвращает готовый Response, поэтому FastAPI
+# не сериализует его повторно; response_model остается только для документации
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def response_columns(model, schema) -> list:
+    # Колонки модели SQLAlchemy в порядке полей схемы ответа
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+def rows_to_dicts(keys, rows) -> list[dict]:
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def json_rows(result) -> FastJSONResponse:
+    # result - результат execute() по select(колонки...)
+    return FastJSONResponse(rows_to_dicts(list(result.keys()), result.all()))
@@ -0,0 +1,107 @@
+import logging
+import os
+import random
+import time
+from collections import deque
+
+from fastapi import APIRouter, Query
+from sqlalchemy import event
+
+from metrics import get_current_route
+
+
+# Журнал медленных запросов. Все, что дольше SLOW_QUERY_MS, попадает в кольцевой буфер
+# вместе с параметрами, маршрутом и планом EXPLAIN QUERY PLAN (план кэшируется по тексту SQL).
+# SLOW_QUERY_SAMPLE_RATE < 1 замеряет только долю запросов - так журнал можно держать
+# включенным в продакшене: у остальных запросов не берется даже время
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+SLOW_QUERY_PLAN_CACHE_SIZE = int(os.getenv("SLOW_QUERY_PLAN_CACHE_SIZE", "500"))
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+logger = logging.getLogger("slow_query")
+
+recent = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+plans: dict[str, list[str] | None] = {}
+
+
+def explain(conn, statement: str, parameters) -> list[str] | None:
+    if statement in plans:
+        return plans[statement]
+
+    plan = None
+    if statement.lstrip().upper().startswith(EXPLAINABLE):
+        # Сырой курсор DBAPI: события SQLAlchemy на нем не срабатывают, рекурсии не будет
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            plan = [row[3] for row in cursor.fetchall()]
+        except Exception:
+            plan = None
+        finally:
+            cursor.close()
+
+    if len(plans) >= SLOW_QUERY_PLAN_CACHE_SIZE:
+        plans.pop(next(iter(plans)))
+    plans[statement] = plan
+    return plan
+
+
+def full_scans(plan: list[str] | None) -> list[str]:
+    # "SCAN tasks" - полный проход по таблице; "SCAN ... USING INDEX" - по индексу
+    return [step for step in plan or [] if step.startswith("SCAN ") and "INDEX" not in step]
+
+
+def watch_engine(engine, name: str):
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        sampled = SLOW_QUERY_SAMPLE_RATE >= 1 or random.random() < SLOW_QUERY_SAMPLE_RATE
+        context._slowlog_started = time.perf_counter() if sampled else None
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def check_duration(conn, cursor, statement, parameters, context, executemany):
+        started = context._slowlog_started
+        if started is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < SLOW_QUERY_MS:
+            return
+
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        plan = explain(conn, statement, parameters)
+        entry = {
+            "at": time.time(),
+            "engine": name,
+            "route": get_current_route(),
+            "duration_ms": round(duration_ms, 3),
+            "statement": statement,
+            "parameters": repr(parameters)[:500],
+            "executemany": executemany,
+            "plan": plan,
+            "full_scans": full_scans(plan),
+        }
+        recent.append(entry)
+        logger.warning(
+            "slow query %.1fms route=%s engine=%s: %s %s",
+            duration_ms, entry["route"], name, statement, entry["parameters"]
+        )
+
+
+router = APIRouter(prefix="/diagnostics", tags=["Diagnostics"])
+
+
+@router.get("/slow_queries")
+async def slow_queries(limit: int = Query(50, ge=1, le=SLOW_QUERY_LOG_SIZE)):
+    entries = list(recent)[-limit:]
+    entries.reverse()
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "sample_rate": SLOW_QUERY_SAMPLE_RATE,
+        "cached_plans": len(plans),
+        "entries": entries,
+    }
@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.util import await_only
+
+# Базы приложения читают адреса из окружения при импорте: задаем их до импорта модулей
+TMP = tempfile.mkdtemp(prefix="appi-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{TMP}/family.db"
+os.environ["TASKS_DATABASE_URL"] = f"sqlite+aiosqlite:///{TMP}/tasks.db"
+os.environ["CHECK_DATABASE_URL"] = f"sqlite+aiosqlite:///{TMP}/check.db"
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import asyncSQL
+
+    with TestClient(asyncSQL.app) as client:
+        yield client
+
+
+@pytest.fixture
+def family_sqlite():
+    import sqlite3
+
+    conn = sqlite3.connect(f"{TMP}/family.db")
+    yield conn
+    conn.close()
+
+
+class StatementTrace:
+    # Все SQL, которые SQLite реально выполнил на соединениях движка, включая BEGIN/COMMIT
+    # самого драйвера (sqlite3 set_trace_callback)
+    def __init__(self):
+        self.statements = []
+
+    def committed_transactions(self) -> int:
+        # Сколько раз закрылась внешняя транзакция: COMMIT или RELEASE самой внешней точки
+        # сохранения, если перед ней не было BEGIN (тогда SAVEPOINT сам открыл транзакцию)
+        commits = 0
+        in_transaction = False
+        savepoints = []
+        for statement in self.statements:
+            word = statement.split(None, 1)[0].upper()
+            if word == "BEGIN":
+                in_transaction = True
+            elif word in ("COMMIT", "END"):
+                commits += 1
+                in_transaction = False
+                savepoints = []
+            elif word == "ROLLBACK" and "TO" not in statement.upper().split():
+                in_transaction = False
+                savepoints = []
+            elif word == "SAVEPOINT":
+                savepoints.append(in_transaction)
+                in_transaction = True
+            elif word == "RELEASE" and savepoints:
+                outer = savepoints.pop()
+                if not outer:
+                    commits += 1
+                    in_transaction = False
+        return commits
+
+
+@pytest.fixture
+def trace_engine(client):
+    traces = []
+
+    def attach(engine) -> StatementTrace:
+        trace = StatementTrace()
+
+        def on_connect(dbapi_connection, connection_record):
+            await_only(dbapi_connection.driver_connection.set_trace_callback(trace.statements.append))
+
+        # Трассировку получают новые соединения: открытые закрываем
+        event.listen(engine.sync_engine, "connect", on_connect)
+        client.portal.call(engine.dispose)
+        traces.append((engine, on_connect))
+        return trace
+
+    yield attach
+    for engine, on_connect in traces:
+        event.remove(engine.sync_engine, "connect", on_connect)
+        client.portal.call(engine.dispose)
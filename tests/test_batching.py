@@ -0,0 +1,28 @@
+import asyncio
+
+from batching import WriteCoalescer
+from db import family_db
+from models import Parent
+
+
+def test_batch_with_bad_row_is_one_commit(client, family_sqlite, trace_engine):
+    existing = family_sqlite.execute("INSERT INTO parents (name) VALUES ('existing')").lastrowid
+    family_sqlite.commit()
+    trace = trace_engine(family_db.write_engine)
+    coalescer = WriteCoalescer(family_db.write_engine, window_ms=50, max_batch=100)
+    # Две группы в одной пачке: строки без id и строки с id. Во второй группе одна строка
+    # с занятым id роняет многострочный INSERT, и группа пишется по одной строке
+    rows = [{"name": "batched"} for _ in range(5)]
+    rows += [{"id": existing + 1000 + i, "name": "batched"} for i in range(10)] + [{"id": existing, "name": "dup"}]
+
+    async def insert_all():
+        return await asyncio.gather(*(coalescer.insert(Parent.__table__, row) for row in rows), return_exceptions=True)
+
+    results = client.portal.call(insert_all)
+    assert [isinstance(result, Exception) for result in results] == [False] * 15 + [True]
+    assert trace.committed_transactions() == 1
+    inserted = family_sqlite.execute(
+        "SELECT COUNT(*) FROM parents WHERE id BETWEEN ? AND ?", (existing + 1000, existing + 1009)
+    ).fetchone()
+    assert inserted == (10,)
+    assert sum(result.name == "batched" for result in results[:5]) == 5
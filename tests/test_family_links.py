@@ -0,0 +1,63 @@
+import family
+from db import async_session
+
+
+def add_people(conn, table: str, count: int) -> list[int]:
+    ids = [conn.execute(f"INSERT INTO {table} (name) VALUES ('test')").lastrowid for _ in range(count)]
+    conn.commit()
+    return ids
+
+
+def links_of(conn, children: list[int]) -> list[tuple]:
+    marks = ",".join("?" * len(children))
+    return conn.execute(f"SELECT parent_id, child_id FROM association WHERE child_id IN ({marks})", children).fetchall()
+
+
+def test_rollback_discards_links_written_in_savepoints(client, family_sqlite):
+    [parent] = add_people(family_sqlite, "parents", 1)
+    [child] = add_people(family_sqlite, "children", 1)
+
+    async def insert_and_roll_back():
+        async with async_session() as db:
+            created, _ = await family.insert_links([(parent, child)], db)
+            await db.rollback()
+        return created
+
+    assert client.portal.call(insert_and_roll_back) == {(parent, child)}
+    assert links_of(family_sqlite, [child]) == []
+
+
+def test_failed_links_request_leaves_no_rows(client, family_sqlite, monkeypatch):
+    [parent] = add_people(family_sqlite, "parents", 1)
+    children = add_people(family_sqlite, "children", 2)
+
+    async def broken_link_error(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(family, "link_error", broken_link_error)
+    response = client.post("/family/links", json=[
+        {"parent_id": parent, "child_id": children[0]},
+        {"parent_id": 10 ** 9, "child_id": children[1]},
+    ])
+    assert response.status_code == 500
+    assert links_of(family_sqlite, children) == []
+
+
+def test_failed_bulk_request_leaves_no_rows(client, family_sqlite, monkeypatch):
+    parents = add_people(family_sqlite, "parents", 2)
+    children = add_people(family_sqlite, "children", 3)
+    statements = []
+    insert_links_stmt = family.insert_links_stmt
+
+    def failing_on_third_chunk(chunk):
+        statements.append(chunk)
+        if len(statements) == 3:
+            raise RuntimeError("boom")
+        return insert_links_stmt(chunk)
+
+    monkeypatch.setattr(family, "BULK_CHUNK_SIZE", 2)
+    monkeypatch.setattr(family, "insert_links_stmt", failing_on_third_chunk)
+    response = client.post("/family/bulk", json=[{"parent1": parents[0], "parent2": parents[1], "children": children}])
+    assert response.status_code == 500
+    assert len(statements) == 3
+    assert links_of(family_sqlite, children) == []
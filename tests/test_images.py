@@ -0,0 +1,41 @@
+import images
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 64
+
+
+def create_user(client) -> int:
+    user = {"name": "pic", "email": "pic@example.com", "password": "secret", "image": ""}
+    return client.post("/users/users", json=user).json()["id"]
+
+
+def test_malformed_multipart_is_400(client):
+    user_id = create_user(client)
+    response = client.post(
+        f"/users/users/{user_id}/image",
+        content=b"--xyz\r\nContent-Disposition form-data\r\n\r\n" + PNG + b"\r\n--xyz--\r\n",
+        headers={"Content-Type": "multipart/form-data; boundary=xyz"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Malformed multipart body")
+
+
+def test_thumbnail_errors_name_the_cause(client, monkeypatch):
+    user_id = create_user(client)
+    uploaded = client.post(f"/users/users/{user_id}/image", files={"file": ("a.png", PNG, "image/png")})
+    assert uploaded.status_code in (200, 201), uploaded.text
+    digest = uploaded.json()["image"]
+    size = images.IMAGE_THUMB_SIZES[0]
+
+    monkeypatch.setattr(images, "Image", None)
+    response = client.get(f"/users/images/{digest}/thumb/{size}")
+    assert response.status_code == 404
+    assert "Pillow is not installed" in response.json()["detail"]
+
+    async def undecodable(digest, source):
+        return []
+
+    monkeypatch.setattr(images, "Image", object())
+    monkeypatch.setattr(images.thumbnails, "ensure", undecodable)
+    response = client.get(f"/users/images/{digest}/thumb/{size}")
+    assert response.status_code == 404
+    assert "could not be decoded" in response.json()["detail"]
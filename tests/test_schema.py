@@ -0,0 +1,52 @@
+import asyncio
+import sqlite3
+
+import main
+from db import Database
+from schema import ensure_schema
+
+# Таблица задач, как ее создавала модель Task до версионирования схемы: без deadline_on,
+# индексов, FTS и сводки task_stats
+BASELINE_TASKS = """
+CREATE TABLE tasks (
+    id INTEGER NOT NULL PRIMARY KEY,
+    category VARCHAR,
+    title VARCHAR NOT NULL,
+    description VARCHAR NOT NULL,
+    status BOOLEAN NOT NULL,
+    priority INTEGER,
+    deadline VARCHAR,
+    percent INTEGER NOT NULL
+)
+"""
+
+
+def test_upgrade_baseline_tasks_db(tmp_path):
+    path = tmp_path / "tasks.db"
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_TASKS)
+    conn.execute(
+        "INSERT INTO tasks (id, category, title, description, status, priority, deadline, percent) "
+        "VALUES (1, 'home', 'Old task', 'from the baseline', 0, 1, '2024-15-06', 10)"
+    )
+    conn.commit()
+    conn.close()
+
+    database = Database("tasks-baseline", f"sqlite+aiosqlite:///{path}", main.tasks_schema)
+
+    async def upgrade():
+        try:
+            return [await ensure_schema(database.write_engine, main.tasks_schema) for _ in range(2)]
+        finally:
+            await database.dispose()
+
+    assert asyncio.run(upgrade()) == ["migrated", "current"]
+
+    conn = sqlite3.connect(path)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {index.name for index in main.Task.__table__.indexes} <= indexes
+    assert conn.execute("SELECT deadline_on FROM tasks WHERE id = 1").fetchone() == ("2024-06-15",)
+    assert conn.execute("SELECT category, count FROM task_stats").fetchall() == [("home", 1)]
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM tasks WHERE status = 0 AND deadline_on < '2025-01-01'").fetchall()
+    assert "ix_tasks_status_deadline_on" in plan[0][3]
+    conn.close()
@@ -0,0 +1,38 @@
+import pytest
+
+import transfer
+
+CSV = {"Content-Type": "text/csv"}
+
+
+def import_csv(client, kind: str, job: str, body: str):
+    return client.post(f"/family/import/{kind}", params={"job": job}, content=body, headers=CSV)
+
+
+def test_resume_after_crash_between_links_and_checkpoint(client, family_sqlite, monkeypatch):
+    job = "crash-before-checkpoint"
+    assert import_csv(client, "parents", job, "id,name\np1,Anna\np2,Boris\n").status_code == 200
+    assert import_csv(client, "children", job, "id,name\nc1,Vera\nc2,Gleb\n").status_code == 200
+    links = "parent,child\np1,c1\np2,c1\np1,c2\n"
+
+    import_links = transfer.ImportRun.import_links
+
+    async def crash_after_insert(self, chunk):
+        # Связи записаны, а rows_done еще не обновлен и пачка не закоммичена
+        await import_links(self, chunk)
+        raise RuntimeError("crash before checkpoint")
+
+    monkeypatch.setattr(transfer.ImportRun, "import_links", crash_after_insert)
+    with pytest.raises(RuntimeError):
+        import_csv(client, "links", job, links)
+    monkeypatch.undo()
+
+    children = [row[0] for row in family_sqlite.execute(
+        "SELECT id FROM import_id_map WHERE job = ? AND kind = 'children'", (job,)
+    )]
+    marks = ",".join("?" * len(children))
+    assert family_sqlite.execute(f"SELECT COUNT(*) FROM association WHERE child_id IN ({marks})", children).fetchone() == (0,)
+
+    result = import_csv(client, "links", job, links).json()
+    assert (result["resumed_from"], result["created"], result["duplicates"]) == (0, 3, 0)
+    assert result["finished"]
@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import os
+import sys
+from typing import Annotated, AsyncIterator, Literal
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import AliasChoices, BaseModel, BeforeValidator, Field, StringConstraints, TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+
+from cache import cache, invalidate_link
+from changes import changes, publish_links
+from db import async_session, engine, family_schema, read_session
+from family import insert_links
+from models import Child, ImportIdMap, ImportJob, ImportResult, ImportRowError, Parent, ParentChildAssociation
+from pagination import STREAM_BATCH_SIZE, ndjson_response
+from schema import ensure_schema
+from serialization import dumps, rows_to_dicts
+
+
+# Перенос больших объемов данных: импорт CSV/NDJSON потоком, пачками по IMPORT_CHUNK_SIZE строк.
+# Каждая пачка - одна транзакция вместе с контрольной точкой (import_jobs.rows_done), поэтому
+# прерванный импорт продолжается повторной отправкой того же файла с тем же job: уже
+# закоммиченные строки пропускаются. Внешние id из файла сопоставляются с новыми id через
+# import_id_map, так связи из файла находят своих родителей и детей.
+# Экспорт отдает таблицу потоком в тех же форматах, память не зависит от числа строк
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))  # сколько ошибок строк вернуть в ответе
+
+Kind = Literal["parents", "children", "links"]
+Format = Literal["csv", "ndjson"]
+
+PERSON_MODELS = {"parents": Parent, "children": Child}
+CACHE_KINDS = {"parents": "parent", "children": "child"}
+
+
+def external_id(value):
+    # В NDJSON id бывают числами, в CSV - всегда строки
+    return str(value) if isinstance(value, int) else value
+
+
+ExternalId = Annotated[str, BeforeValidator(external_id), StringConstraints(min_length=1, max_length=100)]
+
+
+class PersonRow(BaseModel):
+    # Файл экспорта (id, name) годится для импорта как есть: id становится внешним id
+    external_id: ExternalId = Field(validation_alias=AliasChoices("external_id", "id"))
+    name: str = Field(max_length=50)
+
+
+class LinkRow(BaseModel):
+    parent: ExternalId = Field(validation_alias=AliasChoices("parent", "parent_id"))
+    child: ExternalId = Field(validation_alias=AliasChoices("child", "child_id"))
+
+
+ROW_ADAPTERS = {PersonRow: TypeAdapter(list[PersonRow]), LinkRow: TypeAdapter(list[LinkRow])}
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | str]]:
+    # Отдает (номер строки файла, запись) или (номер строки, текст ошибки разбора)
+    line_no = 0
+    if fmt == "ndjson":
+        async for line in iter_lines(chunks):
+            line_no += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, f"invalid JSON: {e}"
+                continue
+            yield line_no, record if isinstance(record, dict) else "expected a JSON object"
+        return
+
+    # CSV: первая запись - заголовок. Поле в кавычках может содержать перевод строки,
+    # поэтому копим строки, пока кавычек не станет четное число
+    header = None
+    pending = []
+    start = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not pending:
+            start = line_no
+        pending.append(line.rstrip("\r"))
+        record = "\n".join(pending)
+        if record.count('"') % 2:
+            continue
+        pending = []
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield start, f"expected {len(header)} columns, got {len(values)}"
+            continue
+        yield start, dict(zip(header, values))
+    if pending:
+        yield start, "unterminated quoted field"
+
+
+class ImportRun:
+    def __init__(self, db, job: str, kind: str, state: ImportJob):
+        self.db = db
+        self.job = job
+        self.kind = kind
+        self.state = state
+        self.resumed_from = state.rows_done
+        self.rows_read = 0
+        self.errors: list[ImportRowError] = []
+
+    def reject(self, line: int, error: str):
+        self.state.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(ImportRowError(line=line, error=error))
+
+    def validate(self, model, chunk: list[tuple[int, dict | str]]) -> list[tuple[int, BaseModel]]:
+        parsed = []
+        for line, record in chunk:
+            if isinstance(record, str):
+                self.reject(line, record)
+            else:
+                parsed.append((line, record))
+
+        # Обычно вся пачка валидна и проверяется одним вызовом; иначе ищем плохие строки по одной
+        try:
+            rows = ROW_ADAPTERS[model].validate_python([record for _, record in parsed])
+            return [(line, row) for (line, _), row in zip(parsed, rows)]
+        except ValidationError:
+            pass
+
+        rows = []
+        for line, record in parsed:
+            try:
+                rows.append((line, model.model_validate(record)))
+            except ValidationError as e:
+                error = e.errors()[0]
+                self.reject(line, f"{'.'.join(map(str, error['loc']))}: {error['msg']}")
+        return rows
+
+    async def mapped_ids(self, kind: str, external_ids) -> dict[str, int]:
+        result = await self.db.execute(
+            select(ImportIdMap.external_id, ImportIdMap.id).where(
+                ImportIdMap.job == self.job, ImportIdMap.kind == kind, ImportIdMap.external_id.in_(external_ids)
+            )
+        )
+        return dict(result.all())
+
+    async def import_people(self, chunk) -> list:
+        model = PERSON_MODELS[self.kind]
+        rows = self.validate(PersonRow, chunk)
+        known = await self.mapped_ids(self.kind, {row.external_id for _, row in rows})
+        new_rows = {}
+        for _, row in rows:
+            if row.external_id in known or row.external_id in new_rows:
+                self.state.duplicates += 1
+            else:
+                new_rows[row.external_id] = row
+        if not new_rows:
+            return []
+
+        table = model.__table__
+        ids = (await self.db.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True),
+            [{"name": row.name} for row in new_rows.values()]
+        )).scalars().all()
+        await self.db.execute(insert(ImportIdMap), [
+            {"job": self.job, "kind": self.kind, "external_id": external_id, "id": new_id}
+            for external_id, new_id in zip(new_rows, ids)
+        ])
+        self.state.created += len(ids)
+        return [(CACHE_KINDS[self.kind], new_id) for new_id in ids]
+
+    async def import_links(self, chunk) -> list:
+        rows = self.validate(LinkRow, chunk)
+        parents = await self.mapped_ids("parents", {row.parent for _, row in rows})
+        children = await self.mapped_ids("children", {row.child for _, row in rows})
+        pairs = {}
+        for line, row in rows:
+            if row.parent not in parents:
+                self.reject(line, f"unknown parent {row.parent!r} in job {self.job!r}")
+            elif row.child not in children:
+                self.reject(line, f"unknown child {row.child!r} in job {self.job!r}")
+            else:
+                pair = (parents[row.parent], children[row.child])
+                if pair in pairs:
+                    self.state.duplicates += 1
+                else:
+                    pairs[pair] = line
+
+        created, rejected = await insert_links(list(pairs), self.db)
+        for pair in rejected:
+            self.reject(pairs[pair], "child already has two parents or the link is invalid")
+        self.state.created += len(created)
+        self.state.duplicates += len(pairs) - len(created) - len(rejected)
+        return list(created)
+
+    async def commit_chunk(self, chunk):
+        if self.kind == "links":
+            touched = await self.import_links(chunk)
+        else:
+            touched = await self.import_people(chunk)
+        self.state.rows_done += len(chunk)
+        await self.db.commit()
+
+        if self.kind == "links":
+            for parent_id, child_id in touched:
+                invalidate_link(parent_id, child_id)
+            publish_links("family", "imported", touched, job=self.job)
+        else:
+            cache.invalidate(*touched)
+            if touched:
+                changes.publish("family", "imported", entity=self.kind, count=len(touched), job=self.job)
+
+    def result(self) -> ImportResult:
+        return ImportResult(
+            job=self.job,
+            kind=self.kind,
+            rows_read=self.rows_read,
+            resumed_from=self.resumed_from,
+            created=self.state.created,
+            duplicates=self.state.duplicates,
+            rejected=self.state.rejected,
+            finished=self.state.finished,
+            errors=self.errors,
+        )
+
+
+# Один импорт на (job, kind) за раз, иначе два потока одного файла задвоят строки
+active_imports: set[tuple[str, str]] = set()
+
+
+async def import_records(job: str, kind: str, records: AsyncIterator[tuple[int, dict | str]]) -> ImportResult:
+    if (job, kind) in active_imports:
+        raise HTTPException(status_code=409, detail=f"Import {job!r}/{kind} is already running")
+    active_imports.add((job, kind))
+    try:
+        async with async_session() as db:
+            state = await db.get(ImportJob, (job, kind))
+            if state is None:
+                state = ImportJob(job=job, kind=kind, rows_done=0, created=0, duplicates=0, rejected=0, finished=False)
+                db.add(state)
+            await db.commit()  # не держим соединение писателя, пока читаем первую пачку
+            run = ImportRun(db, job, kind, state)
+
+            chunk = []
+            async for line, record in records:
+                run.rows_read += 1
+                if run.rows_read <= run.resumed_from:
+                    continue  # закоммичено в прошлый раз
+                chunk.append((line, record))
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    await run.commit_chunk(chunk)
+                    chunk = []
+            if chunk:
+                await run.commit_chunk(chunk)
+
+            if run.rows_read < run.resumed_from:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"File has {run.rows_read} rows, but {run.resumed_from} were already imported for this job"
+                )
+            state.finished = True
+            await db.commit()
+            return run.result()
+    finally:
+        active_imports.discard((job, kind))
+
+
+EXPORT_STATEMENTS = {
+    "parents": select(Parent.id, Parent.name).order_by(Parent.id),
+    "children": select(Child.id, Child.name).order_by(Child.id),
+    "links": select(ParentChildAssociation.parent_id, ParentChildAssociation.child_id).order_by(
+        ParentChildAssociation.parent_id, ParentChildAssociation.child_id
+    ),
+}
+
+
+class CSVBuffer:
+    # csv.writer пишет в объект с методом write; копим строки пачки и отдаем их одним куском
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+    def take(self) -> bytes:
+        data = "".join(self.parts).encode("utf-8")
+        self.parts.clear()
+        return data
+
+
+async def export_csv(stmt, batch_size: int = STREAM_BATCH_SIZE) -> AsyncIterator[bytes]:
+    buffer = CSVBuffer()
+    writer = csv.writer(buffer, lineterminator="\n")
+    async with read_session() as session:
+        result = await session.stream(stmt.execution_options(yield_per=batch_size))
+        writer.writerow(list(result.keys()))
+        async for batch in result.partitions():
+            writer.writerows(batch)
+            yield buffer.take()
+    tail = buffer.take()
+    if tail:
+        yield tail
+
+
+def detect_format(request: Request, fmt: Format | None) -> str:
+    if fmt is not None:
+        return fmt
+    return "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+
+router = APIRouter(prefix="/family", tags=["Transfer"])
+
+
+@router.post("/import/{kind}", response_model=ImportResult)
+async def import_file(
+    kind: Kind,
+    request: Request,
+    job: str = Query(min_length=1, max_length=100, description="имя импорта: общее для parents, children и links"),
+    format: Format | None = Query(None, description="по умолчанию из Content-Type: text/csv или NDJSON")
+):
+    return await import_records(job, kind, iter_records(request.stream(), detect_format(request, format)))
+
+
+@router.get("/import/{job}", response_model=list[ImportResult])
+async def import_status(job: str):
+    async with read_session() as db:
+        states = (await db.execute(select(ImportJob).where(ImportJob.job == job).order_by(ImportJob.kind))).scalars().all()
+    return [
+        ImportResult(
+            job=state.job, kind=state.kind, rows_read=state.rows_done, resumed_from=0, created=state.created,
+            duplicates=state.duplicates, rejected=state.rejected, finished=state.finished, errors=[]
+        )
+        for state in states
+    ]
+
+
+@router.get("/export/{kind}")
+async def export_file(kind: Kind, format: Format = "ndjson"):
+    stmt = EXPORT_STATEMENTS[kind]
+    if format == "ndjson":
+        return ndjson_response(read_session, stmt)
+    return StreamingResponse(
+        export_csv(stmt),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{kind}.csv"'}
+    )
+
+
+# CLI для тех же операций без HTTP:
+# python transfer.py import parents legacy parents.csv
+# python transfer.py export links links.ndjson
+async def read_file(path: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def export_to_file(kind: str, path: str, fmt: str):
+    stmt = EXPORT_STATEMENTS[kind]
+    with open(path, "wb") as f:
+        if fmt == "csv":
+            async for data in export_csv(stmt):
+                f.write(data)
+        else:
+            async with read_session() as session:
+                result = await session.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+                keys = list(result.keys())
+                async for batch in result.partitions():
+                    f.write(b"".join(dumps(row) + b"\n" for row in rows_to_dicts(keys, batch)))
+
+
+async def cli(args):
+    await ensure_schema(engine, family_schema)
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    try:
+        if args.command == "import":
+            result = await import_records(args.job, args.kind, iter_records(read_file(args.path), fmt))
+            print(result.model_dump_json(indent=2))
+        else:
+            await export_to_file(args.kind, args.path, fmt)
+            print(f"{args.kind} exported to {args.path}", file=sys.stderr)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import/export parents, children and links")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("kind", choices=["parents", "children", "links"])
+    import_parser.add_argument("job")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["csv", "ndjson"])
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("kind", choices=["parents", "children", "links"])
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=["csv", "ndjson"])
+    asyncio.run(cli(parser.parse_args()))
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import re
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event
+
+from cache import LRUCache, MISSING
+
+
+# Условные GET для списочных эндпоинтов. У каждой таблицы есть счетчик версий, который растет
+# после каждой записи в нее; ETag списка = случайный номер запуска процесса + версии таблиц
+# + хэш query string. Пока версии не изменились, на If-None-Match отвечаем 304, не трогая
+# ни базу, ни сериализатор. Последние отрендеренные тела хранятся в памяти по тому же ключу.
+# Счетчики живут в памяти процесса: записи из другого процесса (второй воркер uvicorn, сырой
+# sqlite3) их не поднимают, поэтому приложение с условными GET запускается одним воркером
+ETAG_BODY_CACHE_SIZE = int(os.getenv("ETAG_BODY_CACHE_SIZE", "256"))
+ETAG_BODY_CACHE_MAX_BYTES = int(os.getenv("ETAG_BODY_CACHE_MAX_BYTES", str(1024 * 1024)))
+
+# Таблица, в которую пишет DML-запрос (в том числе сырой SQL и запросы из CLI)
+WRITE_PATTERN = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+["`\[]?(\w+)',
+    re.IGNORECASE,
+)
+
+
+class TableVersions:
+    def __init__(self):
+        # Номер запуска: после рестарта старые ETag клиентов не совпадут с новыми версиями
+        self.boot = os.urandom(4).hex()
+        self.versions: dict[str, int] = {}
+
+    def bump(self, *tables: str):
+        for table in tables:
+            self.versions[table] = self.versions.get(table, 0) + 1
+
+    def etag(self, tables: tuple[str, ...], key: str) -> str:
+        state = ".".join(str(self.versions.get(table, 0)) for table in tables)
+        digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        return f'"{self.boot}-{state}-{digest}"'
+
+
+table_versions = TableVersions()
+bodies = LRUCache(maxsize=ETAG_BODY_CACHE_SIZE, ttl=None)
+
+
+def track_writes(engine):
+    # Запоминаем таблицы, в которые писало соединение, и поднимаем их версии, когда
+    # соединение возвращается в пул - то есть уже после COMMIT/ROLLBACK. Если поднять
+    # версию до коммита, читатель успеет закэшировать старые данные под новой версией.
+    # Откат тоже поднимает версию: лишний промах кэша безопаснее устаревшего ответа
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def remember_write(conn, cursor, statement, parameters, context, executemany):
+        match = WRITE_PATTERN.match(statement)
+        if match:
+            conn.info.setdefault("written_tables", set()).add(match.group(1).lower())
+
+    @event.listens_for(sync_engine.pool, "checkin")
+    def bump_on_release(dbapi_connection, connection_record):
+        tables = connection_record.info.pop("written_tables", None)
+        if tables:
+            table_versions.bump(*tables)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+async def conditional_response(request: Request, tables: tuple[str, ...], render) -> Response:
+    # render() строит обычный ответ; вызывается, только если у клиента и в памяти нет этой версии.
+    # Версию читаем до чтения базы: запись, закоммиченная позже, поднимет версию еще раз
+    key = f"{request.url.path}?{request.url.query}"
+    etag = table_versions.etag(tables, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = bodies.get((key, etag))
+    if cached is not MISSING:
+        body, media_type = cached
+        return Response(body, media_type=media_type, headers=headers)
+
+    response = await render()
+    if response.status_code == 200:
+        body = getattr(response, "body", None)  # у потоковых ответов тела целиком нет
+        if body is not None and len(body) <= ETAG_BODY_CACHE_MAX_BYTES:
+            bodies.set((key, etag), (body, response.media_type))
+        response.headers.update(headers)
+    return response